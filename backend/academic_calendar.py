@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""校历：学期开始日期登记表 + 每天最多查询一次的教务系统当前周 (getXlzc)
+
+学期开始日期来自 JSON 登记表 (SEMESTER_CALENDAR_FILE，默认 semesters.json):
+    {"2025-2026-1": "2025-09-01", "2025-2026-2": "2026-02-23"}
+文件修改后自动重新加载 (最多每 RELOAD_INTERVAL 秒检查一次 mtime)，不必重启服务；
+文件缺失或格式错误时沿用上一次成功加载的内容 (首次加载失败则用内置默认值)。
+
+登记表里有的学期，当前周与某周某天的日期直接在内存中计算，不访问上游。
+登记表里没有的学期才使用教务系统的 getXlzc：结果写入共享状态文件 (CALENDAR_STATE_PATH)，
+同一台机器的所有 worker 每天只查询一次；抢到当天 claim 文件的 worker 负责查询，
+其他 worker 在结果写入前先用前一天的值。
+"""
+import datetime
+import json
+import os
+import tempfile
+import time
+from typing import Optional
+
+from singleflight import SingleFlight
+
+RELOAD_INTERVAL = 30
+CLAIM_TIMEOUT = 30  # 负责查询的 worker 失败或退出后，多久之后其他 worker 可以重新查询
+
+def default_state_path() -> str:
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, "hbut-calendar.json")
+
+class SemesterRegistry:
+    """学期代码 -> 开学日期 (周一)，文件变化时热加载"""
+
+    def __init__(self, path: Optional[str], defaults: dict):
+        self.path = path
+        self._dates = self._parse(defaults)
+        self._mtime = None
+        self._checked = 0.0
+
+    @staticmethod
+    def _parse(raw: dict) -> dict:
+        dates = {}
+        for xnxq, value in raw.items():
+            try:
+                day = datetime.date.fromisoformat(value)
+            except (TypeError, ValueError):
+                print(f"[calendar] 忽略无效日期 {xnxq}: {value!r}")
+                continue
+            if day.weekday() != 0:
+                print(f"[calendar] 忽略 {xnxq}: {value} 不是周一")
+                continue
+            dates[xnxq] = day
+        return dates
+
+    def dates(self) -> dict:
+        now = time.monotonic()
+        if self.path and now - self._checked >= RELOAD_INTERVAL:
+            self._checked = now
+            self._reload()
+        return self._dates
+
+    def _reload(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+            if mtime == self._mtime:
+                return
+            with open(self.path, encoding="utf-8") as f:
+                raw = json.load(f)
+            if not isinstance(raw, dict):
+                raise ValueError("顶层须为对象")
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"[calendar] 加载 {self.path} 失败，沿用当前登记表: {e}")
+            return
+        self._mtime = mtime
+        self._dates = self._parse(raw)
+
+class AcademicCalendar:
+    def __init__(self, registry: SemesterRegistry, state_path: Optional[str] = None):
+        self.registry = registry
+        self.state_path = state_path or default_state_path()
+        self._week = None  # (日期, 当前周)：本 worker 内的当天缓存
+        self._flight = SingleFlight()
+
+    @classmethod
+    def from_env(cls, defaults: dict):
+        path = os.environ.get("SEMESTER_CALENDAR_FILE",
+                              os.path.join(os.path.dirname(os.path.abspath(__file__)), "semesters.json"))
+        return cls(SemesterRegistry(path or None, defaults), os.environ.get("CALENDAR_STATE_PATH") or None)
+
+    # ---------- 登记表 ----------
+    def start_date(self, xnxq: str) -> Optional[datetime.date]:
+        return self.registry.dates().get(xnxq)
+
+    def current_semester(self, today: Optional[datetime.date] = None) -> Optional[str]:
+        """已开学的最新学期"""
+        today = today or datetime.date.today()
+        started = [k for k, v in self.registry.dates().items() if v <= today]
+        return max(started) if started else None
+
+    def week_of(self, xnxq: str, today: Optional[datetime.date] = None) -> Optional[int]:
+        """登记表中学期的当前周 (还没开学为 1)；学期不在登记表中返回 None"""
+        start = self.start_date(xnxq)
+        if start is None:
+            return None
+        days = ((today or datetime.date.today()) - start).days
+        return days // 7 + 1 if days >= 0 else 1
+
+    def date_of(self, xnxq: str, week: int, weekday: int) -> Optional[datetime.date]:
+        """第 week 周星期 weekday (1-7) 的日期；学期不在登记表中返回 None"""
+        start = self.start_date(xnxq)
+        if start is None:
+            return None
+        return start + datetime.timedelta(weeks=week - 1, days=weekday - 1)
+
+    # ---------- 上游当前周 ----------
+    async def upstream_week(self, fetch) -> Optional[int]:
+        """今天的 getXlzc 结果；fetch 为查询上游的无参协程函数。
+
+        每天只查询一次 (所有 worker 共享)；尚未查到时返回前一天的值，从未查到过返回 None。
+        """
+        today = datetime.date.today().isoformat()
+        if self._week and self._week[0] == today:
+            return self._week[1]
+        state = self._read_state()
+        if state.get("date") == today:
+            self._week = (today, state["xlzc"])
+            return state["xlzc"]
+        week = await self._flight.do(("xlzc", today), lambda: self._refresh(today, fetch))
+        return state.get("xlzc") if week is None else week
+
+    async def _refresh(self, today: str, fetch) -> Optional[int]:
+        """抢到 claim 的 worker 查询上游并写入共享状态；没抢到或查询失败返回 None"""
+        if not self._claim(today):
+            return None
+        # 抢到 claim 之前，另一个 worker 可能刚好查完
+        state = self._read_state()
+        if state.get("date") != today:
+            try:
+                state = {"date": today, "xlzc": await fetch()}
+            except Exception as e:
+                # claim 保留到超时，避免每个请求都重试失败的上游
+                print(f"[calendar] 查询当前周失败: {e}")
+                return None
+            self._write_state(state)
+        self._week = (today, state["xlzc"])
+        self._release(today)
+        return state["xlzc"]
+
+    def _read_state(self) -> dict:
+        try:
+            with open(self.state_path, encoding="utf-8") as f:
+                state = json.load(f)
+            return state if isinstance(state, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _write_state(self, state: dict):
+        tmp = f"{self.state_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(state, f)
+            os.replace(tmp, self.state_path)
+        except OSError as e:
+            print(f"[calendar] 写入 {self.state_path} 失败: {e}")
+
+    def _claim_path(self, today: str) -> str:
+        return f"{self.state_path}.{today}.claim"
+
+    def _claim(self, today: str) -> bool:
+        """抢当天的查询权 (O_EXCL 创建 claim 文件)；超时的 claim 视为失效"""
+        path = self._claim_path(today)
+        for _ in range(2):
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return True
+            except FileExistsError:
+                try:
+                    if time.time() - os.stat(path).st_mtime < CLAIM_TIMEOUT:
+                        return False
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+            except OSError:
+                return True  # 无法创建 claim 文件 (目录不可写等)：各 worker 自行查询
+        return False
+
+    def _release(self, today: str):
+        try:
+            os.unlink(self._claim_path(today))
+        except OSError:
+            pass
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""上游请求的自适应超时与对冲请求 (hedged requests)
+
+按 URL (不含查询参数) 统计最近 WINDOW 次请求到响应头的耗时 (每个 worker 各自统计):
+- 超时 = p99 × TIMEOUT_FACTOR，限制在 [MIN_TIMEOUT, 调用方的固定超时 × MAX_STRETCH] 之间；
+  样本不足 MIN_SAMPLES 时仍用调用方的固定超时。
+- 对冲：幂等 GET 超过该 URL 的 p95 仍未返回时，再发一份相同的请求，用先成功的那个，另一个取消。
+  对冲次数受令牌桶限制：每个请求积累 hedge_ratio 个令牌 (最多 HEDGE_BURST 个)，对冲一次消耗 1 个，
+  对冲请求因此不超过总请求数的 hedge_ratio，上游整体变慢时也不会让请求量翻倍。
+"""
+import threading
+from collections import deque
+from typing import Optional
+
+WINDOW = 200
+MIN_SAMPLES = 20
+REFRESH_EVERY = 10      # 每新增多少个样本重新计算一次分位数
+TIMEOUT_FACTOR = 3.0
+MIN_TIMEOUT = 2.0
+MAX_STRETCH = 2.0
+MIN_HEDGE_DELAY = 0.05
+HEDGE_BURST = 10.0
+
+class _Window:
+    __slots__ = ("values", "pending", "p95", "p99")
+
+    def __init__(self):
+        self.values = deque(maxlen=WINDOW)
+        self.pending = 0
+        self.p95 = self.p99 = None
+
+    def add(self, seconds: float):
+        self.values.append(seconds)
+        self.pending += 1
+        if len(self.values) >= MIN_SAMPLES and (self.p99 is None or self.pending >= REFRESH_EVERY):
+            ordered = sorted(self.values)
+            self.p95 = ordered[int(0.95 * (len(ordered) - 1))]
+            self.p99 = ordered[int(0.99 * (len(ordered) - 1))]
+            self.pending = 0
+
+class AdaptiveTimeouts:
+    def __init__(self, hedge_urls=(), hedge_ratio: float = 0.05, on_hedge=None):
+        self.hedge_urls = frozenset(hedge_urls)
+        self.hedge_ratio = hedge_ratio
+        self.on_hedge = on_hedge  # on_hedge("sent" / "won")，用于计数
+        self._windows = {}
+        self._budget = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, url: str, seconds: float):
+        window = self._windows.get(url)
+        if window is None:
+            window = self._windows.setdefault(url, _Window())
+        window.add(seconds)
+        with self._lock:
+            self._budget = min(HEDGE_BURST, self._budget + self.hedge_ratio)
+
+    def timeout(self, url: str, default: float) -> float:
+        window = self._windows.get(url)
+        if window is None or window.p99 is None:
+            return default
+        return min(max(window.p99 * TIMEOUT_FACTOR, MIN_TIMEOUT), default * MAX_STRETCH)
+
+    def hedge_delay(self, url: str) -> Optional[float]:
+        """该 URL 可以对冲时返回等待多久再发第二份，否则 None"""
+        if url not in self.hedge_urls:
+            return None
+        window = self._windows.get(url)
+        if window is None or window.p95 is None:
+            return None
+        return max(window.p95, MIN_HEDGE_DELAY)
+
+    def take_hedge(self) -> bool:
+        with self._lock:
+            if self._budget < 1.0:
+                return False
+            self._budget -= 1.0
+        if self.on_hedge:
+            self.on_hedge("sent")
+        return True
+
+    def hedge_won(self):
+        if self.on_hedge:
+            self.on_hedge("won")
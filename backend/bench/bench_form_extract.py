@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""登录页字段提取基准：form_extract vs BeautifulSoup(html.parser)
+
+用法: python bench/bench_form_extract.py [次数]
+"""
+import os
+import sys
+import timeit
+
+from bs4 import BeautifulSoup
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+from form_extract import find_input_values
+
+FIXTURES = os.path.join(BACKEND_DIR, "fixtures")
+
+LOGIN_FIELDS = {"execution": ("name", "execution"), "salt": ("id", "pwdEncryptSalt"), "lt": ("name", "lt")}
+XHID_FIELDS = {"xhid": ("id", "xhid")}
+
+def bs_login(page):
+    soup = BeautifulSoup(page, 'html.parser')
+    lt_tag = soup.find('input', {'name': 'lt'})
+    return {
+        "execution": soup.find('input', {'name': 'execution'})['value'],
+        "salt": soup.find('input', {'id': 'pwdEncryptSalt'})['value'],
+        "lt": lt_tag['value'] if lt_tag else ""
+    }
+
+def bs_xhid(page):
+    inp = BeautifulSoup(page, 'html.parser').find('input', {'id': 'xhid'})
+    return {"xhid": inp.get('value')}
+
+CASES = [
+    ("cas_login.html", LOGIN_FIELDS, bs_login),
+    ("queryKbForXsd.html", XHID_FIELDS, bs_xhid),
+]
+
+def main(number: int):
+    for name, fields, bs_func in CASES:
+        with open(os.path.join(FIXTURES, name), encoding='utf-8') as f:
+            page = f.read()
+        fast = find_input_values(page, fields)
+        assert fast == bs_func(page), f"{name}: 提取结果与 BeautifulSoup 不一致"
+
+        t_bs = timeit.timeit(lambda: bs_func(page), number=number) / number * 1000
+        t_fast = timeit.timeit(lambda: find_input_values(page, fields), number=number) / number * 1000
+        print(f"{name:<22} {len(page) / 1024:>6.1f} KB  "
+              f"bs4: {t_bs:8.3f} ms  fast: {t_fast:8.3f} ms  ({t_bs / t_fast:6.1f}x)")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
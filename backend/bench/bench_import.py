@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""冷启动导入预算：import main 的耗时与不应在导入时加载的重量级模块
+
+在全新的解释器里用 -X importtime 导入 main，输出累计耗时最多的模块；
+导入总耗时超过预算，或 ddddocr / onnxruntime / PIL / bs4 / Crypto 被提前导入时退出码为 1。
+
+用法: python bench/bench_import.py [预算毫秒，默认 IMPORT_BUDGET_MS 或 1500] [次数]
+"""
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAZY_MODULES = ("ddddocr", "onnxruntime", "PIL", "bs4", "Crypto")
+
+CHECK = (
+    "import sys, main; "
+    f"print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"
+)
+
+def import_once() -> tuple:
+    """返回 (总耗时毫秒, [(累计微秒, 模块名)], 提前导入的重量级模块)"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", CHECK],
+        cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+        # 不连接 OCR 服务、不写指标快照，只测导入
+        env={**os.environ, "OCR_SERVICE_SOCKET": "", "METRICS_DIR": ""},
+    )
+    rows = []
+    for line in proc.stderr.splitlines():
+        # "import time: self | cumulative | <每层缩进两个空格>模块名"
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append((int(cumulative_us), name[1:].rstrip()))
+    main_us = next(us for us, name in rows if name == "main")
+    eager = [m for m in proc.stdout.strip().split(",") if m]
+    return main_us / 1000, rows, eager
+
+def main(budget_ms: float, number: int):
+    runs = [import_once() for _ in range(number)]
+    best_ms, rows, eager = min(runs, key=lambda r: r[0])
+    print(f"import main: {best_ms:.0f} ms (最好的一次，共 {number} 次)，预算 {budget_ms:.0f} ms")
+    # main 直接导入的模块 (缩进一层)，按累计耗时排序
+    direct = sorted(((us, name.strip()) for us, name in rows
+                     if name.startswith("  ") and not name.startswith("    ")), reverse=True)[:15]
+    for us, name in direct:
+        print(f"  {us / 1000:8.1f} ms  {name}")
+    ok = True
+    if eager:
+        print(f"FAIL: 导入时加载了 {', '.join(eager)}")
+        ok = False
+    if best_ms > budget_ms:
+        print(f"FAIL: 导入耗时超出预算 {best_ms - budget_ms:.0f} ms")
+        ok = False
+    return ok
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    budget = float(args[0]) if args else float(os.environ.get("IMPORT_BUDGET_MS", 1500))
+    sys.exit(0 if main(budget, int(args[1]) if len(args) > 1 else 3) else 1)
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""验证码识别吞吐对比：OCR 服务 (不同推理线程数) vs 每个 worker 各自加载模型
+
+模拟 W 个 gunicorn worker 同时识别验证码 (每个 worker C 个并发登录)，输出吞吐、延迟与内存：
+- service: 启动 ocr_service.py (--threads T)，W 个客户端进程经 Unix socket 调用
+- local:   W 个进程各自加载 ddddocr 模型，在线程池里推理 (未配置 OCR_SERVICE_SOCKET 时的做法)
+
+用法: python bench/bench_ocr.py [--workers 9] [--concurrency 4] [--images 400] [--threads 1,2,4]
+调整 OCR_THREADS 前先在目标机器上跑一遍：onnxruntime 自身已使用多核，推理线程多了未必更快。
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+import ocr_service
+
+IMAGE_PATH = os.path.join(BACKEND_DIR, "fixtures", "captcha.jpg")
+
+def rss_mb(pid: int) -> float:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+async def _drive(classify, count: int, concurrency: int) -> list:
+    img = open(IMAGE_PATH, "rb").read()
+    latencies = []
+    remaining = [count]
+
+    async def one():
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            start = time.perf_counter()
+            await classify(img)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    await asyncio.gather(*(one() for _ in range(concurrency)))
+    return latencies
+
+def service_worker(socket_path, count, concurrency, start_at, out):
+    client = ocr_service.OcrClient(socket_path)
+    time.sleep(max(0.0, start_at - time.time()))
+    out.put((asyncio.run(_drive(lambda img: client.classify(img, 30), count, concurrency)), 0.0))
+
+def local_worker(count, concurrency, start_at, out):
+    client = ocr_service.OcrClient(None)
+    client.warm_up()
+    time.sleep(max(0.0, start_at - time.time()))
+    latencies = asyncio.run(_drive(lambda img: client.classify(img, 30), count, concurrency))
+    out.put((latencies, rss_mb(os.getpid())))
+
+def run_workers(target, args_for, workers: int):
+    ctx = multiprocessing.get_context("spawn")
+    out = ctx.Queue()
+    start_at = time.time() + 3  # 等所有进程就绪 (local 模式要先加载模型) 再同时开始
+    procs = [ctx.Process(target=target, args=args_for(i) + (start_at, out)) for i in range(workers)]
+    for p in procs:
+        p.start()
+    results = [out.get() for _ in procs]
+    elapsed = time.time() - start_at
+    for p in procs:
+        p.join()
+    latencies = sorted(l for r in results for l in r[0])
+    return latencies, elapsed, sum(r[1] for r in results)
+
+def report(label: str, latencies: list, elapsed: float, mem: float):
+    pick = lambda q: latencies[min(len(latencies) - 1, int(len(latencies) * q))]
+    print(f"{label:<18} {len(latencies) / elapsed:8.1f} 张/秒  p50 {pick(0.5):7.1f} ms  "
+          f"p95 {pick(0.95):7.1f} ms  RSS {mem:6.0f} MB")
+
+def bench_service(threads: int, workers: int, concurrency: int, images: int):
+    socket_path = os.path.join(tempfile.gettempdir(), f"bench-ocr-{os.getpid()}.sock")
+    proc = subprocess.Popen([sys.executable, os.path.join(BACKEND_DIR, "ocr_service.py"),
+                             "--socket", socket_path, "--threads", str(threads)])
+    try:
+        deadline = time.monotonic() + 60
+        while not os.path.exists(socket_path) and time.monotonic() < deadline and proc.poll() is None:
+            time.sleep(0.1)
+        per = images // workers
+        latencies, elapsed, _ = run_workers(service_worker, lambda i: (socket_path, per, concurrency), workers)
+        report(f"service threads={threads}", latencies, elapsed, rss_mb(proc.pid))
+    finally:
+        proc.terminate()
+        proc.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description="验证码识别吞吐对比")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count() * 2 + 1, help="模拟的 worker 数")
+    parser.add_argument("--concurrency", type=int, default=4, help="每个 worker 的并发识别数")
+    parser.add_argument("--images", type=int, default=400, help="识别总张数")
+    parser.add_argument("--threads", default="1,2,4", help="逗号分隔的服务推理线程数")
+    args = parser.parse_args()
+
+    print(f"CPU {multiprocessing.cpu_count()} 核，{args.workers} 个 worker × {args.concurrency} 并发，共 {args.images} 张")
+    for threads in (int(t) for t in args.threads.split(",")):
+        bench_service(threads, args.workers, args.concurrency, args.images)
+    per = args.images // args.workers
+    latencies, elapsed, mem = run_workers(local_worker, lambda i: (per, args.concurrency), args.workers)
+    report("local (每 worker)", latencies, elapsed, mem)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""排名页解析基准：rank_parser (分块增量) vs BeautifulSoup 全量解析
+
+用法: python bench/bench_rank_parser.py [次数] [分块大小]
+"""
+import os
+import re
+import sys
+import timeit
+
+from bs4 import BeautifulSoup
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+from rank_parser import RankPageParser
+
+FIXTURES = os.path.join(BACKEND_DIR, "fixtures")
+CASES = ["getXscjpm_all.html"]
+
+def bs_parse(page):
+    """原先 get_rankings 中的解析方式"""
+    soup = BeautifulSoup(page, 'html.parser')
+    res = {"gpa": "无", "class_rank": "无", "major_rank": "无", "avg_score": "无", "fail_count": "0"}
+    all_text = soup.get_text()
+    gpa_match = re.search(r"平均学分绩点\s*[：:]\s*([0-9.]+)", all_text)
+    if gpa_match: res["gpa"] = gpa_match.group(1)
+    avg_match = re.search(r"算术平均分\s*[：:]\s*([0-9.]+)", all_text)
+    if avg_match: res["avg_score"] = avg_match.group(1)
+    for tr in soup.find_all("tr"):
+        cells = tr.find_all("td")
+        if not cells: continue
+        cell_texts = [td.get_text(strip=True) for td in cells]
+        if len(cell_texts) >= 4 and cell_texts[0] == "平均学分绩点":
+            res["major_rank"] = cell_texts[2]
+            res["class_rank"] = cell_texts[3]
+            break
+    return res
+
+def stream_parse(page, chunk_size):
+    """模拟分块到达：返回 (结果, 实际读取的字节数)"""
+    parser = RankPageParser(budget_ms=1000)
+    read = 0
+    for i in range(0, len(page), chunk_size):
+        chunk = page[i:i + chunk_size]
+        read += len(chunk)
+        if parser.feed(chunk): break
+    parser.close()
+    return parser.result(), read
+
+def main(number: int, chunk_size: int):
+    for name in CASES:
+        with open(os.path.join(FIXTURES, name), encoding='utf-8') as f:
+            page = f.read()
+        expected = bs_parse(page)
+        result, read = stream_parse(page, chunk_size)
+        assert result == expected, f"{name}: {result} != {expected}"
+
+        t_bs = timeit.timeit(lambda: bs_parse(page), number=number) / number * 1000
+        t_stream = timeit.timeit(lambda: stream_parse(page, chunk_size), number=number) / number * 1000
+        print(f"{name:<22} {len(page) / 1024:>6.1f} KB  "
+              f"bs4: {t_bs:8.3f} ms  stream: {t_stream:8.3f} ms  ({t_bs / t_stream:5.1f}x)  "
+              f"读取 {read / len(page):.0%}")
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    main(int(args[0]) if args else 50, int(args[1]) if len(args) > 1 else 8192)
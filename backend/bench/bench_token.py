@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""Token 基准：v1 (JSON + AES-CBC，全部 Cookie) vs v2 (msgpack + AES-GCM，仅教务系统 Cookie)
+
+用法: python bench/bench_token.py [次数]
+"""
+import os
+import sys
+import timeit
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+from token_codec import TokenCodec
+
+# 示例会话：登录后 session 中的 Cookie (统一认证 + 教务系统)，值为同长度的占位串
+CAS_COOKIES = {
+    "route": "a3f1c9d2e4b5a6c7d8e9f0a1b2c3d4e5",
+    "JSESSIONID": "m2Xq9f8Yk1LwZ3pVb7Rt0NcA5sHd4GjE6uIo-node1",
+    "CASTGC": "TGT-123456-Qm9yZWFsbHlMb25nVGlja2V0R3JhbnRpbmdUaWNrZXRWYWx1ZUZvckNBUw-cas01.hbut.edu.cn",
+    "happyVoyage": "Yk1LwZ3pVb7Rt0NcA5sHd4GjE6uIoM2Xq9f8Yk1LwZ3pVb7Rt0NcA5sHd4GjE6uIoPq",
+    "MOD_AUTH_CAS": "MOD_AUTH_ST-98765-abcdefghijklmnopqrst-cas01",
+}
+JW_COOKIES = {
+    "JSESSIONID": "8F2B6C1D9E0A4F7B3C5D8E1A2B4C6D9F",
+    "jw_route": "1768303707.405.1234.567890",
+    "SERVERID": "d2a9c4f1e3b7a8c5d6e0f9a1b2c3d4e5|1768303707|1768303700",
+}
+XHID = "WGEyQ0DB6593E5339A327F2DFAFB7173A79BBC44B15CDCDEB7C726DAA7FEB49D1C125AC200B73B46567C78"
+
+def main(number: int):
+    codec = TokenCodec(b"hbut_miniapp_secret_key_123456".ljust(32, b"\0"))
+    v1_data = {"cookies": {**CAS_COOKIES, **JW_COOKIES}, "xhid": XHID, "stu_id": "2210000000"}
+    v2_data = {"schema": 2, "cookies": JW_COOKIES, "xhid": XHID, "stu_id": "2210000000", "sznj": "2022"}
+
+    v1 = codec.encode_v1(v1_data)
+    v2 = codec.encode(v2_data)
+    assert codec.decode(v1) == v1_data and codec.decode(v2) == v2_data
+
+    t1 = timeit.timeit(lambda: codec.decode(v1), number=number) / number * 1e6
+    t2 = timeit.timeit(lambda: codec.decode(v2), number=number) / number * 1e6
+    print(f"v1: {len(v1):5d} 字节  解码 {t1:7.2f} us")
+    print(f"v2: {len(v2):5d} 字节  解码 {t2:7.2f} us  (体积 {len(v2) / len(v1):.0%})")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
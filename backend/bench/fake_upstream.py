@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""本地模拟上游：统一认证 (auth.hbut.edu.cn) + 教务系统 (hbut.jw.chaoxing.com)
+
+不依赖真实学校服务器做性能测试。实现后端用到的全部接口，返回 fixtures/ 中的样本数据:
+    CAS   GET  /authserver/login              登录页 (每个会话独立的 execution)
+          GET  /authserver/getCaptcha.htl     验证码图片
+          POST /authserver/login              校验 execution，302 跳转教务系统 (附 ticket)；失败返回带新 execution 的登录页
+    教务  GET  /admin/login?ticket=...        校验 ticket，建立教务会话 (JSESSIONID)
+          GET  /admin/api/getXlzc             当前周
+          GET  /admin/pkgl/xskb/queryKbForXsd 课表页 (含 xhid)
+          GET  /admin/pkgl/xskb/sdpkkbList    课表数据
+          POST /admin/xsd/xsdcjcx/xsdQueryXscjList  成绩
+          POST /admin/cjgl/xscjbbdy/printdgxscj     入学年级
+          GET  /admin/cjgl/xscjbbdy/getXscjpm       排名页
+    GET /__sim/stats  各接口请求计数 (JSON)
+
+教务会话过期或无效时，数据接口与真实系统一样返回 200 的 HTML 登录页。
+
+用法:
+    python bench/fake_upstream.py                              # 统一认证 :18001，教务系统 :18002
+    python bench/fake_upstream.py --latency 80 --jitter 40 --error-rate 0.01 \\
+        --expire-rate 0.02 --session-ttl 600 --captcha-fail-rate 0.3 --slow getXscjpm=800
+
+然后启动后端时配置:
+    CAS_BASE_URL=http://127.0.0.1:18001 JW_BASE_URL=http://127.0.0.1:18002
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import sys
+import time
+import uuid
+from collections import Counter
+from urllib.parse import parse_qs, urlsplit
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "fixtures")
+
+# 两个上游在同一个 IP 上，Cookie 不区分端口，所以会话 Cookie 用不同的名字
+CAS_COOKIE = "CASSESSION"
+JW_COOKIE = "JSESSIONID"
+
+EXPIRED_PAGE = ("<html><head><title>统一身份认证</title></head>"
+                "<body><script>top.location.href='/admin/login';</script></body></html>").encode("utf-8")
+ERROR_PAGE = b"<html><body><h1>502 Bad Gateway</h1></body></html>"
+HOME_PAGE = "<html><head><title>湖北工业大学综合教务管理系统</title></head><body>首页</body></html>".encode("utf-8")
+
+_EXECUTION_RE = re.compile(r'(name="execution" value=")[^"]*(")')
+
+def _load(name: str) -> bytes:
+    with open(os.path.join(FIXTURES, name), "rb") as f:
+        return f.read()
+
+class Response:
+    __slots__ = ("status", "body", "content_type", "headers")
+
+    def __init__(self, status: str = "200 OK", body: bytes = b"", content_type: str = "text/html;charset=UTF-8", headers=()):
+        self.status = status
+        self.body = body
+        self.content_type = content_type
+        self.headers = list(headers)
+
+    def encode(self) -> bytes:
+        lines = [f"HTTP/1.1 {self.status}", f"Content-Type: {self.content_type}", f"Content-Length: {len(self.body)}"]
+        lines.extend(f"{k}: {v}" for k, v in self.headers)
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("utf-8") + self.body
+
+def _json(payload: bytes) -> Response:
+    return Response(body=payload, content_type="application/json;charset=UTF-8")
+
+class FakeUpstream:
+    """模拟上游的全部状态；可以独立运行，也可以嵌入压测脚本 (见 start())"""
+
+    def __init__(self, latency_ms: float = 0, jitter_ms: float = 0, error_rate: float = 0,
+                 expire_rate: float = 0, session_ttl: float = 1800, captcha_fail_rate: float = 0,
+                 slow: dict = None):
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.error_rate = error_rate
+        self.expire_rate = expire_rate
+        self.session_ttl = session_ttl
+        self.captcha_fail_rate = captcha_fail_rate
+        self.slow = {k: v / 1000 for k, v in (slow or {}).items()}  # 接口名 (路径最后一段) -> 固定延迟
+        self.jw_base = ""
+        self.stats = Counter()
+        self.cas_sessions = {}  # CASSESSION -> 当前 execution
+        self.tickets = {}       # ticket -> 学号
+        self.jw_sessions = {}   # JSESSIONID -> (学号, 创建时间)
+
+        self.login_page = _load("cas_login.html").decode("utf-8")
+        self.captcha = _load("captcha.jpg")
+        self.routes = {
+            ("GET", "/authserver/login"): self.cas_login_page,
+            ("GET", "/authserver/getCaptcha.htl"): self.cas_captcha,
+            ("POST", "/authserver/login"): self.cas_submit,
+            ("GET", "/admin/login"): self.jw_login,
+            ("GET", "/admin/index"): self.jw_page(HOME_PAGE),
+            ("GET", "/admin/api/getXlzc"): self.jw_json(_load("getXlzc.json")),
+            ("GET", "/admin/pkgl/xskb/queryKbForXsd"): self.jw_page(_load("queryKbForXsd.html")),
+            ("GET", "/admin/pkgl/xskb/sdpkkbList"): self.jw_json(_load("sdpkkbList.json")),
+            ("POST", "/admin/xsd/xsdcjcx/xsdQueryXscjList"): self.jw_json(_load("xsdQueryXscjList.json")),
+            ("POST", "/admin/cjgl/xscjbbdy/printdgxscj"): self.jw_json(_load("printdgxscj.json")),
+            ("GET", "/admin/cjgl/xscjbbdy/getXscjpm"): self.jw_page(_load("getXscjpm_all.html")),
+            ("GET", "/__sim/stats"): self.get_stats,
+        }
+
+    # ---------- 统一认证 ----------
+    def _render_login(self, sid: str) -> Response:
+        execution = uuid.uuid4().hex
+        self.cas_sessions[sid] = execution
+        page = _EXECUTION_RE.sub(lambda m: m.group(1) + execution + m.group(2), self.login_page, count=1)
+        return Response(body=page.encode("utf-8"), headers=[("Set-Cookie", f"{CAS_COOKIE}={sid}; Path=/; HttpOnly")])
+
+    def cas_login_page(self, query, form, cookies):
+        sid = cookies.get(CAS_COOKIE) or uuid.uuid4().hex
+        return self._render_login(sid)
+
+    def cas_captcha(self, query, form, cookies):
+        return Response(body=self.captcha, content_type="image/jpeg")
+
+    def cas_submit(self, query, form, cookies):
+        sid = cookies.get(CAS_COOKIE)
+        execution = self.cas_sessions.pop(sid, None) if sid else None
+        if not sid or execution != form.get("execution") or random.random() < self.captcha_fail_rate:
+            # 验证码错误：与真实系统一样返回带新 execution 的登录页，同一会话可继续提交
+            self.stats["login_failed"] += 1
+            return self._render_login(sid or uuid.uuid4().hex)
+        ticket = f"ST-{uuid.uuid4().hex}"
+        self.tickets[ticket] = form.get("username", "")
+        return Response("302 Found", headers=[("Location", f"{self.jw_base}/admin/login?ticket={ticket}")])
+
+    # ---------- 教务系统 ----------
+    def _jw_user(self, cookies):
+        """返回会话对应的学号；会话不存在或已过期返回 None"""
+        sid = cookies.get(JW_COOKIE)
+        entry = self.jw_sessions.get(sid) if sid else None
+        if entry is None:
+            return None
+        if time.monotonic() - entry[1] > self.session_ttl or random.random() < self.expire_rate:
+            del self.jw_sessions[sid]
+            self.stats["session_expired"] += 1
+            return None
+        return entry[0]
+
+    def jw_login(self, query, form, cookies):
+        ticket = query.get("ticket")
+        if ticket:
+            stu_id = self.tickets.pop(ticket, None)
+            if stu_id is None:
+                return Response("302 Found", headers=[("Location", "/admin/login")])
+            sid = uuid.uuid4().hex.upper()
+            self.jw_sessions[sid] = (stu_id, time.monotonic())
+            return Response("302 Found", headers=[
+                ("Set-Cookie", f"{JW_COOKIE}={sid}; Path=/; HttpOnly"), ("Location", "/admin/index")])
+        if self._jw_user(cookies) is None:
+            return Response(body=EXPIRED_PAGE)
+        return Response("302 Found", headers=[("Location", "/admin/index")])
+
+    def jw_page(self, body: bytes):
+        def handler(query, form, cookies):
+            return Response(body=body if self._jw_user(cookies) is not None else EXPIRED_PAGE)
+        return handler
+
+    def jw_json(self, payload: bytes):
+        def handler(query, form, cookies):
+            return _json(payload) if self._jw_user(cookies) is not None else Response(body=EXPIRED_PAGE)
+        return handler
+
+    def get_stats(self, query, form, cookies):
+        return _json(json.dumps(self.stats, ensure_ascii=False).encode("utf-8"))
+
+    # ---------- HTTP ----------
+    async def dispatch(self, method: str, target: str, headers: dict, body: bytes) -> Response:
+        url = urlsplit(target)
+        handler = self.routes.get((method, url.path))
+        if handler is None:
+            return Response("404 Not Found", b"Not Found")
+        name = url.path.rsplit("/", 1)[-1]
+        self.stats[name] += 1
+        if not url.path.startswith("/__sim/"):
+            delay = self.slow.get(name, self.latency)
+            if self.jitter:
+                delay += random.expovariate(1 / self.jitter)
+            if delay:
+                await asyncio.sleep(delay)
+            if random.random() < self.error_rate:
+                self.stats["error_injected"] += 1
+                return Response("502 Bad Gateway", ERROR_PAGE)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        form = {k: v[0] for k, v in parse_qs(body.decode("utf-8", "replace")).items()} if body else {}
+        cookies = {}
+        for part in headers.get("cookie", "").split(";"):
+            key, _, value = part.strip().partition("=")
+            if key: cookies[key] = value
+        return handler(query, form, cookies)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """HTTP/1.1 keep-alive：同一连接上依次处理多个请求"""
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except asyncio.IncompleteReadError:
+                    break
+                lines = head.decode("latin-1").split("\r\n")
+                method, target, _ = lines[0].split(" ", 2)
+                headers = {}
+                for line in lines[1:]:
+                    if ":" in line:
+                        k, v = line.split(":", 1)
+                        headers[k.strip().lower()] = v.strip()
+                length = int(headers.get("content-length", 0))
+                body = await reader.readexactly(length) if length else b""
+                resp = await self.dispatch(method, target, headers, body)
+                writer.write(resp.encode())
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host: str = "127.0.0.1", cas_port: int = 18001, jw_port: int = 18002):
+        """启动两个监听端口，返回 (服务器列表, CAS_BASE_URL, JW_BASE_URL)"""
+        self.jw_base = f"http://{host}:{jw_port}"
+        servers = [await asyncio.start_server(self.handle, host, port) for port in (cas_port, jw_port)]
+        return servers, f"http://{host}:{cas_port}", self.jw_base
+
+def parse_slow(items) -> dict:
+    slow = {}
+    for item in items or ():
+        name, _, ms = item.partition("=")
+        slow[name] = float(ms)
+    return slow
+
+async def main(args):
+    sim = FakeUpstream(args.latency, args.jitter, args.error_rate, args.expire_rate,
+                       args.session_ttl, args.captcha_fail_rate, parse_slow(args.slow))
+    servers, cas_base, jw_base = await sim.start(args.host, args.cas_port, args.jw_port)
+    print(f"模拟上游已启动\n    CAS_BASE_URL={cas_base}\n    JW_BASE_URL={jw_base}")
+    try:
+        await asyncio.gather(*(s.serve_forever() for s in servers))
+    finally:
+        print(f"请求计数: {dict(sim.stats)}", file=sys.stderr)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本地模拟统一认证 + 教务系统")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--cas-port", type=int, default=18001)
+    parser.add_argument("--jw-port", type=int, default=18002)
+    parser.add_argument("--latency", type=float, default=0, help="每个请求的基础延迟 (毫秒)")
+    parser.add_argument("--jitter", type=float, default=0, help="额外延迟，指数分布的均值 (毫秒)")
+    parser.add_argument("--error-rate", type=float, default=0, help="返回 502 的比例")
+    parser.add_argument("--expire-rate", type=float, default=0, help="教务会话被提前判定过期的比例")
+    parser.add_argument("--session-ttl", type=float, default=1800, help="教务会话有效期 (秒)")
+    parser.add_argument("--captcha-fail-rate", type=float, default=0, help="登录提交被判定验证码错误的比例")
+    parser.add_argument("--slow", action="append", metavar="NAME=MS", help="指定接口的固定延迟，如 getXscjpm=800")
+    try:
+        asyncio.run(main(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
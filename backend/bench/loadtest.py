@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+"""考试周 (出成绩当天) 峰值压测：开环到达 + SLO 报告
+
+每个到达代表一名学生：自动登录 (OCR 识别失败时按手动模式再提交一次)，然后查成绩，
+按比例再查排名 / 课表。到达间隔服从泊松分布，速率在 --ramp 秒内从 --rate 线性升到 --peak 后保持，
+与服务端的处理速度无关 (开环)，服务端变慢时请求会堆积，而不是自动减压。
+
+对每组 gunicorn 配置依次：启动模拟上游 (bench/fake_upstream.py) 与 gunicorn，
+压测 --duration 秒，采样 master 下所有子进程的 RSS，输出各接口 p50/p95/p99、吞吐、错误率与 SLO 判定。
+
+用法:
+    python bench/loadtest.py --workers 2,4,8 --rate 5 --peak 60 --ramp 30 --duration 90
+    python bench/loadtest.py --config gunicorn_config.py --config my_config.py \\
+        --upstream "--latency 120 --jitter 80 --captcha-fail-rate 0.3" --slo p95=2000,p99=5000,error=0.01
+    python bench/loadtest.py --target http://127.0.0.1:8000 ...   # 压测已在运行的后端 (不采样 RSS)
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shlex
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MIX = "rankings=0.3,timetable=0.5"
+DEFAULT_SLO = "p95=3000,p99=8000,error=0.01"
+
+# ---------- 统计 ----------
+class Recorder:
+    def __init__(self):
+        self.latency = defaultdict(list)  # 接口 -> [毫秒]
+        self.outcomes = defaultdict(lambda: defaultdict(int))  # 接口 -> 结果 -> 次数
+
+    def add(self, route: str, ms: float, outcome: str):
+        self.latency[route].append(ms)
+        self.outcomes[route][outcome] += 1
+
+    def total(self) -> int:
+        return sum(len(v) for v in self.latency.values())
+
+    def errors(self) -> int:
+        return sum(o["error"] for o in self.outcomes.values())
+
+def percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+async def call(client, rec: Recorder, route: str, payload: dict, label: str = None, ok=(200,), expected=()):
+    """发送一次 API 请求并按 label (默认为接口路径) 记录；返回响应 JSON (失败为 None)"""
+    start = time.perf_counter()
+    try:
+        resp = await client.post(route, json=payload)
+        body = resp.json()
+        code = body.get("code")
+        outcome = "ok" if code in ok else ("expected" if code in expected else "error")
+    except (httpx.HTTPError, ValueError):
+        body, outcome = None, "error"
+    rec.add(label or route, (time.perf_counter() - start) * 1000, outcome)
+    return body if outcome != "error" else None
+
+async def student(client, rec: Recorder, mix: dict, think: float):
+    """一名学生的完整访问：登录 -> 成绩 -> (排名) -> (课表)"""
+    username = f"22{random.randint(0, 10 ** 8 - 1):08d}"
+    creds = {"username": username, "password": "loadtest"}
+    body = await call(client, rec, "/api/login", creds, expected=(429,))
+    if body and body["code"] == 429:
+        # 自动识别失败：模拟用户看图输入验证码后提交
+        await asyncio.sleep(think)
+        # 模拟上游按 --captcha-fail-rate 判定验证码错误，相当于用户输错，不算作服务端错误
+        body = await call(client, rec, "/api/login", {**creds, "token": body["data"]["token"], "captcha": "abcd"},
+                          label="/api/login (manual)", expected=(401,))
+    if not body or body.get("code") != 200:
+        return
+    token = body["user_token"]
+    await call(client, rec, "/api/grades", {"token": token})
+    if random.random() < mix.get("rankings", 0):
+        await call(client, rec, "/api/rankings", {"token": token, "username": username, "semester": "all"})
+    if random.random() < mix.get("timetable", 0):
+        await call(client, rec, "/api/timetable", {"token": token})
+
+async def drive(base_url: str, args, mix: dict) -> tuple:
+    """开环产生到达，返回 (Recorder, 实际耗时秒)"""
+    rec = Recorder()
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=200)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        tasks = set()
+        start = time.monotonic()
+        while (elapsed := time.monotonic() - start) < args.duration:
+            rate = args.rate + (args.peak - args.rate) * min(1.0, elapsed / args.ramp) if args.ramp else args.peak
+            await asyncio.sleep(random.expovariate(max(rate, 0.01)))
+            task = asyncio.create_task(student(client, rec, mix, args.think))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.wait(tasks)
+        return rec, time.monotonic() - start
+
+# ---------- 进程管理 ----------
+def wait_ready(url: str, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"{url} 在 {timeout} 秒内未就绪")
+
+def child_pids(ppid: int) -> list:
+    pids = []
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat") as f:
+                # 进程名可能含空格，从最后一个 ')' 之后取字段
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == ppid:
+            pids.append(int(name))
+    return pids
+
+def rss_mb(pid: int) -> float:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+class RssSampler(threading.Thread):
+    """每秒采样 gunicorn master 的全部子进程 (worker 与 OCR 服务)，记录峰值"""
+
+    def __init__(self, master_pid: int):
+        super().__init__(daemon=True)
+        self.master_pid = master_pid
+        self.peak_total = 0.0
+        self.peak_single = 0.0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(1.0):
+            sizes = [rss_mb(pid) for pid in child_pids(self.master_pid)]
+            self.peak_total = max(self.peak_total, sum(sizes))
+            self.peak_single = max(self.peak_single, max(sizes, default=0.0))
+
+def start_upstream(upstream_args: str, cas_port: int, jw_port: int) -> subprocess.Popen:
+    cmd = [sys.executable, os.path.join(BACKEND_DIR, "bench", "fake_upstream.py"),
+           "--cas-port", str(cas_port), "--jw-port", str(jw_port), *shlex.split(upstream_args)]
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL)
+    time.sleep(0.5)
+    return proc
+
+def start_gunicorn(config: str, workers: int, port: int, env: dict) -> subprocess.Popen:
+    cmd = [sys.executable, "-m", "gunicorn", "-c", config, "-b", f"127.0.0.1:{port}", "--access-logfile", "/dev/null"]
+    if workers:
+        cmd += ["-w", str(workers)]
+    cmd.append("main:app")
+    return subprocess.Popen(cmd, cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def stop(proc: subprocess.Popen):
+    if proc.poll() is None:
+        proc.send_signal(signal.SIGTERM)
+        try:
+            proc.wait(15)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+# ---------- 报告 ----------
+def parse_kv(spec: str) -> dict:
+    return {k.strip(): float(v) for k, v in (item.split("=", 1) for item in spec.split(",") if item.strip())}
+
+def summarize(name: str, rec: Recorder, elapsed: float, sampler, slo: dict) -> dict:
+    every = [ms for values in rec.latency.values() for ms in values]
+    total = rec.total()
+    summary = {
+        "config": name, "requests": total, "throughput_rps": round(total / elapsed, 1),
+        "error_rate": round(rec.errors() / total, 4) if total else 0.0,
+        "p50_ms": round(percentile(every, 0.50), 1), "p95_ms": round(percentile(every, 0.95), 1),
+        "p99_ms": round(percentile(every, 0.99), 1),
+        "routes": {
+            route: {
+                "count": len(values), "outcomes": dict(rec.outcomes[route]),
+                **{f"p{q}_ms": round(percentile(values, q / 100), 1) for q in (50, 95, 99)},
+            } for route, values in sorted(rec.latency.items())
+        },
+    }
+    if sampler:
+        summary["rss_peak_total_mb"] = round(sampler.peak_total, 1)
+        summary["rss_peak_process_mb"] = round(sampler.peak_single, 1)
+    observed = {"error": summary["error_rate"], "p50": summary["p50_ms"], "p95": summary["p95_ms"], "p99": summary["p99_ms"]}
+    summary["slo"] = {key: observed[key] <= limit for key, limit in slo.items()}
+    return summary
+
+def print_summary(s: dict):
+    print(f"\n=== {s['config']} ===")
+    print(f"请求 {s['requests']}  吞吐 {s['throughput_rps']} req/s  错误率 {s['error_rate']:.2%}  "
+          f"p50/p95/p99 {s['p50_ms']}/{s['p95_ms']}/{s['p99_ms']} ms")
+    if "rss_peak_total_mb" in s:
+        print(f"RSS 峰值: 合计 {s['rss_peak_total_mb']} MB，单进程 {s['rss_peak_process_mb']} MB")
+    print(f"{'接口':<22}{'次数':>8}{'p50':>10}{'p95':>10}{'p99':>10}  结果")
+    for route, r in s["routes"].items():
+        print(f"{route:<22}{r['count']:>8}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}  {r['outcomes']}")
+    print("SLO: " + "  ".join(f"{k} {'PASS' if ok else 'FAIL'}" for k, ok in s["slo"].items()))
+
+def run_one(name: str, args, mix: dict, slo: dict, config: str = None, workers: int = 0) -> dict:
+    if args.target:
+        rec, elapsed = asyncio.run(drive(args.target, args, mix))
+        return summarize(name, rec, elapsed, None, slo)
+
+    upstream = start_upstream(args.upstream, args.cas_port, args.jw_port)
+    tmp = tempfile.mkdtemp(prefix="hbut-loadtest-")
+    env = {
+        **os.environ,
+        "CAS_BASE_URL": f"http://127.0.0.1:{args.cas_port}", "JW_BASE_URL": f"http://127.0.0.1:{args.jw_port}",
+        "OCR_SERVICE_SOCKET": os.path.join(tmp, "ocr.sock"), "METRICS_DIR": os.path.join(tmp, "metrics"),
+        "UPSTREAM_GOVERNOR_PATH": os.path.join(tmp, "governor"),
+    }
+    server = start_gunicorn(config, workers, args.port, env)
+    try:
+        base_url = f"http://127.0.0.1:{args.port}"
+        wait_ready(base_url + "/metrics")
+        sampler = RssSampler(server.pid)
+        sampler.start()
+        rec, elapsed = asyncio.run(drive(base_url, args, mix))
+        sampler.stopped.set()
+        return summarize(name, rec, elapsed, sampler, slo)
+    finally:
+        stop(server)
+        stop(upstream)
+
+def main(args):
+    mix, slo = parse_kv(args.mix), parse_kv(args.slo)
+    results = []
+    if args.target:
+        results.append(run_one(args.target, args, mix, slo))
+    else:
+        workers = [int(w) for w in args.workers.split(",")] if args.workers else [0]
+        for config in args.config or ["gunicorn_config.py"]:
+            for w in workers:
+                name = f"{config} workers={w or '默认'}"
+                results.append(run_one(name, args, mix, slo, config, w))
+    for s in results:
+        print_summary(s)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    return all(all(s["slo"].values()) for s in results)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="考试周峰值压测")
+    parser.add_argument("--config", action="append", help="gunicorn 配置文件 (可多次指定，默认 gunicorn_config.py)")
+    parser.add_argument("--workers", help="逗号分隔的 worker 数，与每个配置组合压测；不指定则用配置文件中的值")
+    parser.add_argument("--target", help="直接压测已运行的后端地址，不启动 gunicorn 与模拟上游")
+    parser.add_argument("--rate", type=float, default=5, help="起始到达速率 (学生/秒)")
+    parser.add_argument("--peak", type=float, default=50, help="峰值到达速率 (学生/秒)")
+    parser.add_argument("--ramp", type=float, default=30, help="从起始升到峰值的秒数")
+    parser.add_argument("--duration", type=float, default=90, help="产生到达的总秒数")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="登录并查成绩后，再查排名 / 课表的比例")
+    parser.add_argument("--think", type=float, default=2.0, help="手动输入验证码耗时 (秒)")
+    parser.add_argument("--timeout", type=float, default=60.0, help="单个请求超时 (秒)")
+    parser.add_argument("--slo", default=DEFAULT_SLO, help="p50/p95/p99 (毫秒) 与 error (比例) 上限")
+    parser.add_argument("--upstream", default="--latency 80 --jitter 40 --captcha-fail-rate 0.2",
+                        help="传给 fake_upstream.py 的参数")
+    parser.add_argument("--port", type=int, default=18000)
+    parser.add_argument("--cas-port", type=int, default=18001)
+    parser.add_argument("--jw-port", type=int, default=18002)
+    parser.add_argument("--json", help="把结果另存为 JSON 文件")
+    sys.exit(0 if main(parser.parse_args()) else 1)
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""上游熔断器 (每个上游主机一个，closed / open / half_open)
+
+- closed：正常放行；连续 failure_threshold 次失败 (网络错误、超时、5xx) 后打开
+- open：open_seconds 内该主机的请求直接抛出 CircuitOpen，不再等超时，也不占用限速令牌
+- half_open：冷却结束后只放行一个探测请求，成功则关闭，失败则重新打开；
+  探测请求迟迟没有结果 (被取消等) 时，再过 open_seconds 放行下一个
+
+熔断状态是每个 worker 各自的：一个 worker 连续失败几次就足以判断上游挂了，
+不必跨进程同步。接口捕获 CircuitOpen 后返回该学生最近一次成功的结果 (标记为 stale)。
+"""
+import os
+import threading
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class UpstreamUnavailable(Exception):
+    """上游故障 (5xx 或熔断中)：接口返回旧数据或 503，不能当成会话过期让客户端重新登录"""
+
+class CircuitOpen(UpstreamUnavailable):
+    """上游主机处于熔断状态，请求未发出"""
+
+    def __init__(self, host: str):
+        super().__init__(f"{host} 熔断中")
+        self.host = host
+
+class _Circuit:
+    __slots__ = ("state", "failures", "opened_at", "probe_at")
+
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_at = 0.0
+
+class CircuitBreakers:
+    def __init__(self, failure_threshold: int = 5, open_seconds: float = 15.0, on_event=None):
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.on_event = on_event  # on_event(host, "open" / "half_open" / "closed" / "rejected")，用于监控
+        self._circuits = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, on_event=None):
+        return cls(int(os.environ.get("CIRCUIT_FAILURES", 5)),
+                   float(os.environ.get("CIRCUIT_OPEN_SECONDS", 15)), on_event)
+
+    def _emit(self, host: str, event: str):
+        if self.on_event:
+            self.on_event(host, event)
+
+    def check(self, host: str):
+        """发请求前调用：熔断中抛出 CircuitOpen"""
+        circuit = self._circuits.get(host)
+        if circuit is None or circuit.state == CLOSED:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if circuit.state == OPEN and now - circuit.opened_at >= self.open_seconds:
+                circuit.state = HALF_OPEN
+                circuit.probe_at = now
+                event = HALF_OPEN
+            elif circuit.state == HALF_OPEN and now - circuit.probe_at >= self.open_seconds:
+                circuit.probe_at = now  # 上一个探测请求没有结果，放行下一个
+                event = None
+            else:
+                event = "rejected"
+        if event:
+            self._emit(host, event)
+        if event == "rejected":
+            raise CircuitOpen(host)
+
+    def record(self, host: str, ok: bool):
+        """请求有结果后调用 (被取消、因本请求预算用完而超时的不计)"""
+        circuit = self._circuits.get(host)
+        if circuit is None:
+            if ok:
+                return
+            circuit = self._circuits.setdefault(host, _Circuit())
+        with self._lock:
+            if ok:
+                circuit.failures = 0
+                event = CLOSED if circuit.state != CLOSED else None
+                circuit.state = CLOSED
+            else:
+                circuit.failures += 1
+                if circuit.state == HALF_OPEN or (circuit.state == CLOSED and circuit.failures >= self.failure_threshold):
+                    circuit.state = OPEN
+                    circuit.opened_at = time.monotonic()
+                    event = OPEN
+                else:
+                    event = None
+        if event:
+            self._emit(host, event)
+
+    def state(self, host: str) -> str:
+        circuit = self._circuits.get(host)
+        return circuit.state if circuit else CLOSED
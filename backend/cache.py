@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""进程内 LRU 缓存 (带内存上限与 stale-while-revalidate)
+
+每个条目有两个时间点：
+- fresh_until 之前：直接返回 (新鲜)
+- fresh_until 之后、expire_at 之前：先返回旧值 (stale)，同时在后台刷新
+- expire_at 之后：视为未命中
+"""
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict
+
+FRESH = "fresh"
+STALE = "stale"
+
+def estimate_size(value) -> int:
+    """粗略估算缓存值占用的字节数 (按 JSON 序列化长度)"""
+    try:
+        return len(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+    except (TypeError, ValueError):
+        return 1024
+
+class SWRCache:
+    def __init__(self, max_bytes: int, max_entries: int = 100000):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._data = OrderedDict()  # key -> (value, size, fresh_until, expire_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._tasks = set()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """返回 (value, FRESH/STALE)；未命中返回 (None, None)"""
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[3] <= now:
+                if entry is not None:
+                    self._pop(key)
+                self.misses += 1
+                return None, None
+            self._data.move_to_end(key)
+            if entry[2] > now:
+                self.hits += 1
+                return entry[0], FRESH
+            self.stale_hits += 1
+            return entry[0], STALE
+
+    def set(self, key, value, ttl: float, stale_ttl: float = 0):
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+            self._data[key] = (value, size, now + ttl, now + ttl + stale_ttl)
+            self._bytes += size
+            # 超出内存上限或条目上限时，淘汰最久未使用的条目
+            while self._data and (self._bytes > self.max_bytes or len(self._data) > self.max_entries):
+                self._pop(next(iter(self._data)))
+
+    def _pop(self, key):
+        entry = self._data.pop(key)
+        self._bytes -= entry[1]
+
+    def revalidate(self, key, loader, ttl: float, stale_ttl: float = 0):
+        """后台刷新条目；同一 key 同时只会有一个刷新任务
+
+        loader 为无参协程函数，返回新值；返回 None 或抛出异常时保留旧值。
+        """
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        async def _run():
+            try:
+                value = await loader()
+                if value is not None:
+                    self.set(key, value, ttl, stale_ttl)
+            except Exception:
+                pass
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        task = asyncio.get_running_loop().create_task(_run())
+        # 持有任务引用，防止被垃圾回收
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._data), "bytes": self._bytes, "max_bytes": self.max_bytes,
+                "hits": self.hits, "stale_hits": self.stale_hits, "misses": self.misses
+            }
+
+_MISSING = object()
+
+class TTLCache:
+    """按条目数限制的 LRU + TTL 缓存 (线程安全，不估算内存，适合热路径上的小对象)"""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (value, expire_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING or entry[1] <= now:
+                if entry is not _MISSING:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._data), "max_entries": self.max_entries, "hits": self.hits, "misses": self.misses}
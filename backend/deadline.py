@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""单个 API 请求的总耗时预算
+
+接口在入口创建 Deadline 并交给 UpstreamSession (session.deadline)，之后每次上游请求的超时
+都取 min(该步骤自己的超时, 剩余预算)；预算耗尽时直接抛出 DeadlineExceeded，不再发出请求。
+可选步骤 (如登录时抓取 xhid) 先用 has() 判断剩余预算，不够就 skip() 并记录，
+接口把 skipped 写进响应，客户端据此知道结果不完整。
+"""
+import time
+
+MIN_STEP = 0.2  # 剩余预算不足以完成任何一次上游请求 (秒)
+
+class DeadlineExceeded(Exception):
+    """请求的耗时预算已用完"""
+
+class Deadline:
+    __slots__ = ("budget", "start", "expires", "skipped")
+
+    def __init__(self, budget: float):
+        self.budget = budget
+        self.start = time.monotonic()
+        self.expires = self.start + budget
+        self.skipped = []  # 因预算不足而跳过的可选步骤
+
+    def remaining(self) -> float:
+        return self.expires - time.monotonic()
+
+    def elapsed_ms(self) -> int:
+        return int((time.monotonic() - self.start) * 1000)
+
+    def has(self, seconds: float) -> bool:
+        return self.remaining() >= seconds
+
+    def skip(self, step: str):
+        self.skipped.append(step)
+
+    def timeout(self, cap: float) -> float:
+        """本步骤可用的超时：不超过 cap，也不超过剩余预算"""
+        remaining = self.remaining()
+        if remaining < MIN_STEP:
+            raise DeadlineExceeded(f"预算 {self.budget:g}s 已用完")
+        return min(cap, remaining)
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""轻量的 <input> 字段提取
+
+登录流程只需要 CAS 登录页里的 execution / pwdEncryptSalt / lt 和课表页里的 xhid，
+没必要为此构建整棵 BeautifulSoup 树：这里只扫描 <input> 标签，
+所需字段全部找到即停止；提取失败时调用方再回退到 BeautifulSoup。
+"""
+import html as html_lib
+import re
+
+_INPUT_RE = re.compile(r"<input\b([^>]*)>", re.IGNORECASE)
+_ATTR_RE = re.compile(r"""([\w:.-]+)\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))""")
+
+def _attrs(raw: str) -> dict:
+    attrs = {}
+    for m in _ATTR_RE.finditer(raw):
+        name = m.group(1).lower()
+        if name not in attrs:
+            value = m.group(2) if m.group(2) is not None else m.group(3) if m.group(3) is not None else m.group(4)
+            attrs[name] = html_lib.unescape(value) if "&" in value else value
+    return attrs
+
+def find_input_values(page: str, fields: dict) -> dict:
+    """按属性查找 <input> 的 value
+
+    fields: {结果键: (属性名, 属性值)}，如 {"salt": ("id", "pwdEncryptSalt")}
+    返回找到的 {结果键: value}；缺少 value 属性的视为空字符串。
+    """
+    pending = dict(fields)
+    found = {}
+    for m in _INPUT_RE.finditer(page):
+        raw = m.group(1)
+        # 粗筛：标签里不含任何目标属性值就不解析属性
+        if not any(v in raw for _, v in pending.values()):
+            continue
+        attrs = _attrs(raw)
+        for key, (attr, value) in list(pending.items()):
+            if attrs.get(attr) == value:
+                found[key] = attrs.get("value", "")
+                del pending[key]
+        if not pending:
+            break
+    return found
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""跨 worker 的上游访问限速 (每个主机一个令牌桶)
+
+学校防火墙会封禁高频访问的出口 IP (见 IP_Solutions.md)，而 gunicorn 的每个 worker
+都是独立进程，所以令牌桶状态放在共享内存文件 (mmap) 中，用 flock 互斥，
+同一台机器上的所有 worker 共用同一份额度。
+
+优先级通过 "保留额度" 实现：低优先级请求只能在桶内令牌高于保留比例时取用，
+数据查询 > 登录 > 验证码刷新/预热。额度不足时按优先级排队等待，
+超过最长等待时间抛出 UpstreamBusy，由接口快速返回 503。
+"""
+import asyncio
+import fcntl
+import math
+import mmap
+import os
+import struct
+import tempfile
+import time
+
+PRIORITY_DATA = 0
+PRIORITY_LOGIN = 1
+PRIORITY_CAPTCHA = 2
+
+# 优先级 -> (保留比例, 最长排队秒数)
+PRIORITY_POLICY = {
+    PRIORITY_DATA: (0.0, 3.0),
+    PRIORITY_LOGIN: (0.1, 3.0),
+    PRIORITY_CAPTCHA: (0.3, 0.5),
+}
+
+DEFAULT_LIMITS = "auth.hbut.edu.cn=10/20,hbut.jw.chaoxing.com=20/40"
+RATE_WINDOW = 10.0  # 实际放行速率的统计窗口 (秒)
+
+# 每个主机一个槽位：主机名, 令牌数, 更新时间, 放行数, 拒绝数, 放行速率, 速率更新时间
+_SLOT = struct.Struct("<64sddQQdd")
+MAX_HOSTS = 16
+
+class UpstreamBusy(Exception):
+    """上游访问额度已用完"""
+
+def parse_limits(spec: str) -> dict:
+    """"host=rate/burst,host2=rate/burst" -> {host: (rate, burst)}"""
+    limits = {}
+    for item in filter(None, (s.strip() for s in spec.split(","))):
+        host, value = item.split("=", 1)
+        rate, _, burst = value.partition("/")
+        limits[host.strip()] = (float(rate), float(burst or rate))
+    return limits
+
+def default_state_path() -> str:
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, "hbut-upstream-governor")
+
+class RateGovernor:
+    def __init__(self, limits: dict, path: str = None):
+        self.limits = limits
+        self.path = path or default_state_path()
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        size = _SLOT.size * MAX_HOSTS
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._mem = mmap.mmap(self._fd, size)
+        self._slots = {}
+
+    @classmethod
+    def from_env(cls):
+        return cls(parse_limits(os.environ.get("UPSTREAM_RATE_LIMITS", DEFAULT_LIMITS)),
+                   os.environ.get("UPSTREAM_GOVERNOR_PATH") or None)
+
+    # ---------- 共享内存 ----------
+    def _slot_offset(self, host: str) -> int:
+        """找到 (或占用) 主机对应的槽位，须在持锁时调用"""
+        offset = self._slots.get(host)
+        if offset is not None:
+            return offset
+        name = host.encode("utf-8")[:64]
+        for i in range(MAX_HOSTS):
+            off = i * _SLOT.size
+            slot_name = _SLOT.unpack_from(self._mem, off)[0].rstrip(b"\0")
+            if slot_name == name:
+                break
+            if not slot_name:
+                # 新槽位：桶是满的
+                _SLOT.pack_into(self._mem, off, name, self.limits[host][1], time.time(), 0, 0, 0.0, time.time())
+                break
+        else:
+            raise RuntimeError("限速槽位已用完")
+        self._slots[host] = off
+        return off
+
+    def _locked(self):
+        return _FileLock(self._fd)
+
+    def _refill(self, host: str, off: int, now: float):
+        name, tokens, updated, granted, rejected, rate, rate_ts = _SLOT.unpack_from(self._mem, off)
+        per_sec, burst = self.limits[host]
+        tokens = min(burst, tokens + max(0.0, now - updated) * per_sec)
+        return [name, tokens, now, granted, rejected, rate, rate_ts]
+
+    def _try_take(self, host: str, reserve_ratio: float) -> float:
+        """尝试取一个令牌；成功返回 0，否则返回建议等待的秒数"""
+        per_sec, burst = self.limits[host]
+        with self._locked():
+            off = self._slot_offset(host)
+            now = time.time()
+            slot = self._refill(host, off, now)
+            need = burst * reserve_ratio + 1
+            if slot[1] >= need:
+                slot[1] -= 1
+                slot[3] += 1
+                # 指数衰减计数，约等于最近 RATE_WINDOW 秒内每秒放行数
+                slot[5] = slot[5] * math.exp(-(now - slot[6]) / RATE_WINDOW) + 1 / RATE_WINDOW
+                slot[6] = now
+                wait = 0.0
+            else:
+                wait = (need - slot[1]) / per_sec
+            _SLOT.pack_into(self._mem, off, *slot)
+        return wait
+
+    def _reject(self, host: str):
+        with self._locked():
+            off = self._slot_offset(host)
+            slot = list(_SLOT.unpack_from(self._mem, off))
+            slot[4] += 1
+            _SLOT.pack_into(self._mem, off, *slot)
+
+    # ---------- 对外接口 ----------
+    async def acquire(self, host: str, priority: int = PRIORITY_DATA):
+        """为一次上游请求取令牌；不限速的主机直接放行"""
+        if host not in self.limits:
+            return
+        reserve_ratio, max_wait = PRIORITY_POLICY[priority]
+        deadline = time.monotonic() + max_wait
+        while True:
+            wait = self._try_take(host, reserve_ratio)
+            if wait <= 0:
+                return
+            if time.monotonic() + wait > deadline:
+                self._reject(host)
+                raise UpstreamBusy(host)
+            await asyncio.sleep(wait)
+
+    def snapshot(self) -> dict:
+        """各主机当前令牌数、配置速率、实际放行速率与累计放行/拒绝数"""
+        result = {}
+        with self._locked():
+            now = time.time()
+            for host, (per_sec, burst) in self.limits.items():
+                off = self._slot_offset(host)
+                _, tokens, _, granted, rejected, rate, rate_ts = self._refill(host, off, now)
+                result[host] = {
+                    "tokens": round(tokens, 2), "burst": burst, "limit_per_sec": per_sec,
+                    "rate_per_sec": round(rate * math.exp(-(now - rate_ts) / RATE_WINDOW), 2),
+                    "granted": granted, "rejected": rejected,
+                }
+        return result
+
+class _FileLock:
+    def __init__(self, fd: int):
+        self.fd = fd
+
+    def __enter__(self):
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
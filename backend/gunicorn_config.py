@@ -2,6 +2,12 @@
 # 用于宝塔面板 Python 项目管理器
 
 import multiprocessing
+import os
+import socket
+import glob
+import subprocess
+import sys
+import time
 
 # 服务器socket
 bind = "0.0.0.0:8000"
@@ -14,6 +20,14 @@ worker_connections = 1000
 timeout = 60
 keepalive = 2
 
+# OCR 识别服务 (独立进程，模型只加载一次，所有 worker 共用)
+ocr_socket = os.environ.setdefault("OCR_SERVICE_SOCKET", "/tmp/hbut-ocr.sock")
+ocr_process = None
+OCR_START_TIMEOUT = 60  # 等待识别服务加载模型、监听 socket 的最长时间 (秒)
+
+# 监控指标：各 worker 的快照目录，/metrics 汇总 (启动时删除上一次运行残留的 worker 快照)
+metrics_dir = os.environ.setdefault("METRICS_DIR", "/tmp/hbut-metrics")
+
 # 日志
 accesslog = "-"  # 输出到标准输出
 errorlog = "-"   # 输出到标准错误
@@ -25,7 +39,34 @@ proc_name = "hbut-api"
 
 # 服务器钩子
 def on_starting(server):
+    global ocr_process
     server.log.info("HBUT API 服务正在启动...")
+    # 只删快照文件：METRICS_DIR 由运维配置，可能是与其他程序共用的目录
+    for path in glob.glob(os.path.join(metrics_dir, "worker-*.json")) + glob.glob(os.path.join(metrics_dir, "worker-*.json.tmp")):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ocr_service.py")
+    ocr_process = subprocess.Popen([sys.executable, script, "--socket", ocr_socket])
+    # worker 启动前等服务就绪，否则最早的几次登录会因连不上服务而识别失败
+    if wait_for_ocr(OCR_START_TIMEOUT):
+        server.log.info("OCR 识别服务已启动 (pid %s)，socket: %s", ocr_process.pid, ocr_socket)
+    else:
+        server.log.error("OCR 识别服务未能在 %ss 内就绪 (pid %s, 退出码 %s)，自动识别将失败并改为手动输入验证码",
+                         OCR_START_TIMEOUT, ocr_process.pid, ocr_process.poll())
+
+def wait_for_ocr(timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and ocr_process.poll() is None:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            try:
+                sock.connect(ocr_socket)
+                return True
+            except OSError:
+                pass
+        time.sleep(0.2)
+    return False
 
 def on_reload(server):
     server.log.info("HBUT API 服务正在重新加载...")
@@ -35,4 +76,6 @@ def when_ready(server):
 
 def on_exit(server):
     server.log.info("HBUT API 服务正在关闭...")
+    if ocr_process and ocr_process.poll() is None:
+        ocr_process.terminate()
 
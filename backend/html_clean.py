@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""教务系统字段的 HTML 清洗
+
+课表接口返回的课程名/教室/教师大多是纯文本，少数带 <font> 等标签或 &nbsp; 实体。
+结果与 BeautifulSoup(text, "html.parser").get_text(strip=True) 一致：
+去掉标签，反转义实体，每段文本去首尾空白后直接拼接。
+"""
+import html as html_lib
+import re
+from functools import lru_cache
+
+# 只把真正的标签/注释当作标签，"a < b" 这类文本保持原样
+_TAG_RE = re.compile(r"<!--.*?-->|<[/!?]?[A-Za-z][^>]*>", re.DOTALL)
+
+@lru_cache(maxsize=8192)
+def _clean_markup(text: str) -> str:
+    parts = (html_lib.unescape(p).strip() for p in _TAG_RE.split(text))
+    return "".join(p for p in parts if p)
+
+def clean_text(text) -> str:
+    if not text: return ""
+    if "<" not in text and "&" not in text:
+        return text.strip()
+    return _clean_markup(text)
+
+def clean_rows(rows: list, fields: tuple) -> list:
+    """批量清洗：返回每行指定字段清洗后的元组列表
+
+    同一张课表里教师/教室名反复出现，批内再做一层字典缓存。
+    """
+    memo = {}
+    result = []
+    for row in rows:
+        values = []
+        for field in fields:
+            raw = row.get(field)
+            value = memo.get(raw)
+            if value is None:
+                value = memo[raw] = clean_text(raw)
+            values.append(value)
+        result.append(tuple(values))
+    return result
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""预热的登录上下文池
+
+后台提前完成 "打开 CAS 登录页 → 解析 execution/salt → 获取验证码 → OCR"，
+用户登录时直接从池中取一个现成的上下文，从提交密码开始。
+
+- 每个上下文只用一次，存活时间 (ttl) 短于 CAS execution 的有效期
+- 池大小随最近的登录频率自适应：没人登录时不预热，避免无谓地访问学校服务器
+"""
+import asyncio
+import math
+import time
+from collections import deque
+
+class LoginContextPool:
+    def __init__(self, factory, ttl: float = 90, min_size: int = 0, max_size: int = 8,
+                 window: float = 60, interval: float = 1.0):
+        """factory: 无参协程函数，返回一个登录上下文 (dict)"""
+        self.factory = factory
+        self.ttl = ttl
+        self.min_size = min_size
+        self.max_size = max_size
+        self.window = window
+        self.interval = interval
+        self._ready = deque()  # (created_at, ctx)
+        self._demand = deque()  # 最近的取用时间
+        self._building = 0
+        self._build_time = 1.0  # 构建一个上下文的耗时 (EWMA, 秒)
+        self._wakeup = None
+        self._task = None
+        self._builders = set()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.failures = 0
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._refill_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        self._ready.clear()
+
+    def acquire(self):
+        """取一个可用的上下文；池空时返回 None (调用方自行现场构建)"""
+        now = time.monotonic()
+        self._demand.append(now)
+        self._prune(now)
+        ctx = self._ready.popleft()[1] if self._ready else None
+        if ctx is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        if self._wakeup:
+            self._wakeup.set()
+        return ctx
+
+    def rate(self) -> float:
+        """最近窗口内的登录频率 (次/秒)"""
+        now = time.monotonic()
+        while self._demand and self._demand[0] < now - self.window:
+            self._demand.popleft()
+        return len(self._demand) / self.window
+
+    def target_size(self) -> int:
+        # 保证构建期间到达的登录都能拿到现成上下文 (留一倍余量)
+        want = math.ceil(self.rate() * self._build_time * 2)
+        return max(self.min_size, min(self.max_size, want))
+
+    def _prune(self, now: float):
+        while self._ready and self._ready[0][0] < now - self.ttl:
+            self._ready.popleft()
+            self.expired += 1
+
+    async def _build_one(self):
+        start = time.monotonic()
+        try:
+            ctx = await self.factory()
+            self._ready.append((time.monotonic(), ctx))
+            self._build_time = 0.8 * self._build_time + 0.2 * (time.monotonic() - start)
+        except Exception:
+            self.failures += 1
+        finally:
+            self._building -= 1
+
+    async def _refill_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._prune(time.monotonic())
+            missing = self.target_size() - len(self._ready) - self._building
+            for _ in range(max(0, missing)):
+                self._building += 1
+                task = loop.create_task(self._build_one())
+                self._builders.add(task)
+                task.add_done_callback(self._builders.discard)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> dict:
+        return {
+            "ready": len(self._ready), "building": self._building, "target": self.target_size(),
+            "rate_per_min": round(self.rate() * 60, 2), "build_time_s": round(self._build_time, 3),
+            "hits": self.hits, "misses": self.misses, "expired": self.expired, "failures": self.failures
+        }
@@ -1,33 +1,166 @@
 # -*- coding: utf-8 -*-
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-import requests
-from bs4 import BeautifulSoup
-from Crypto.Cipher import AES
-from Crypto.Util.Padding import pad, unpad
+from contextlib import asynccontextmanager
 import base64
 import uuid
 import random
 import string
 import time
-import re
+import asyncio
 import traceback
+import re
 import json
+import hashlib
 import os
-import datetime # Added datetime
 from typing import Optional
-import ddddocr
-from PIL import Image
-
-# 修复 Pillow 兼容性
-if not hasattr(Image, 'ANTIALIAS'):
-    Image.ANTIALIAS = Image.Resampling.LANCZOS
-
-app = FastAPI(title="HBUT 教务小程序后端")
+from urllib.parse import urljoin, urlsplit
+from upstream import UpstreamSession, close_clients, set_governor, set_proxy_pool, set_observer, set_adaptive, set_breakers, discard_proxy
+from governor import RateGovernor, UpstreamBusy, PRIORITY_LOGIN, PRIORITY_CAPTCHA
+from token_codec import TokenCodec
+from cache import SWRCache, TTLCache, STALE
+from ocr_service import OcrClient, OcrUnavailable, CALL_TIMEOUT as OCR_CALL_TIMEOUT
+from login_pool import LoginContextPool
+from form_extract import find_input_values
+from html_clean import clean_rows
+from rank_parser import RankPageParser
+from singleflight import SingleFlight
+from academic_calendar import AcademicCalendar
+from deadline import Deadline, DeadlineExceeded
+from adaptive import AdaptiveTimeouts
+from breaker import CircuitBreakers, CircuitOpen, UpstreamUnavailable
+from proxy_pool import ProxyPool
+from metrics import Registry
+from tracing import Tracer, span
+
+@asynccontextmanager
+async def lifespan(app):
+    proxy_pool.start()
+    login_pool.start()
+    flusher = asyncio.get_running_loop().create_task(flush_metrics())
+    yield
+    # 退出时停止预热/代理检测并关闭上游连接池
+    flusher.cancel()
+    metrics.flush()
+    await login_pool.stop()
+    await proxy_pool.stop()
+    await close_clients()
+
+app = FastAPI(title="HBUT 教务小程序后端", lifespan=lifespan)
+
+# 上游限速：所有 worker 共享每个主机的令牌桶 (UPSTREAM_RATE_LIMITS 配置速率)
+governor = RateGovernor.from_env()
+set_governor(governor)
+BUSY_RESPONSE = {"code": 503, "msg": "访问人数过多，请稍后再试"}
+# 上游熔断中且没有可返回的旧数据
+UNAVAILABLE_RESPONSE = {"code": 503, "msg": "教务系统暂时无法访问，请稍后再试"}
+
+# 单个请求的总耗时预算 (秒)：须明显小于 gunicorn 的 timeout (60)，预算用完时返回 504，不让 worker 被杀
+REQUEST_DEADLINE = float(os.environ.get("REQUEST_DEADLINE", 20))
+# 剩余预算低于此值时不再开始新一轮自动登录，直接回退到手动输入验证码
+LOGIN_ATTEMPT_MIN_BUDGET = 4
+# 剩余预算低于此值时跳过可选步骤 (课表接口查询 getXlzc 当前周)
+OPTIONAL_STEP_MIN_BUDGET = 3
+
+def deadline_response(deadline: Deadline) -> dict:
+    return {"code": 504, "msg": "教务系统响应超时，请稍后再试",
+            "elapsed_ms": deadline.elapsed_ms(), "skipped": deadline.skipped}
+
+def with_skipped(result: dict, deadline: Deadline) -> dict:
+    """结果因预算不足而不完整时，注明跳过了哪些步骤"""
+    if deadline.skipped and result.get("code") == 200:
+        result["skipped"] = deadline.skipped
+    return result
+
+# ================= 监控指标 (/metrics) =================
+# 各 worker 定期把指标快照写到 METRICS_DIR，/metrics 汇总所有 worker (见 metrics.py)
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", 5))
+metrics = Registry.from_env()
+http_latency = metrics.histogram("hbut_http_request_duration_seconds", "API 接口耗时", ("route",))
+http_in_flight = metrics.gauge("hbut_http_requests_in_flight", "处理中的 API 请求数", ("route",))
+upstream_latency = metrics.histogram(
+    "hbut_upstream_request_duration_seconds", "上游请求耗时 (到响应头)", ("endpoint", "status"))
+upstream_in_flight = metrics.gauge("hbut_upstream_requests_in_flight", "进行中的上游请求数", ("endpoint",))
+ocr_latency = metrics.histogram(
+    "hbut_ocr_duration_seconds", "验证码识别耗时", buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5))
+login_submits = metrics.counter("hbut_login_submits_total", "自动登录的提交次数 (attempt=1 即首次验证码)", ("attempt", "result"))
+login_total = metrics.counter("hbut_login_total", "登录请求结果 (auto + manual_fallback 即回退手动输入)", ("mode", "outcome"))
+token_decrypt_failures = metrics.counter("hbut_token_decrypt_failures_total", "token 解密失败次数")
+token_decrypt_failures.labels().inc(0)  # 没有失败时也输出 0，方便告警规则计算速率
+
+LOGIN_OUTCOMES = {200: "success", 429: "manual_fallback", 503: "busy", 504: "timeout"}
+
+def governor_metrics():
+    """限速状态本就在共享内存里，直接输出全局值"""
+    lines = [
+        "# HELP hbut_upstream_rate_per_second 各上游主机最近实际放行速率",
+        "# TYPE hbut_upstream_rate_per_second gauge",
+    ]
+    snap = governor.snapshot()
+    for host, s in snap.items():
+        lines.append(f'hbut_upstream_rate_per_second{{host="{host}"}} {s["rate_per_sec"]}')
+    for key, kind in (("tokens", "gauge"), ("limit_per_sec", "gauge"), ("granted", "counter"), ("rejected", "counter")):
+        name = f"hbut_upstream_governor_{key}" + ("_total" if kind == "counter" else "")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(f'{name}{{host="{host}"}} {s[key]}' for host, s in snap.items())
+    return lines
+
+metrics.add_collector(governor_metrics)
+
+async def flush_metrics():
+    while True:
+        await asyncio.sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            metrics.flush()
+        except OSError as e:
+            print(f"[metrics] 写入快照失败: {e}")
+
+# 分阶段耗时：TRACE_SAMPLE_RATE 比例的请求 (或带 X-Trace: 1 的请求) 返回 Server-Timing，
+# 配置 TRACE_FILE 时同时写入 JSON-lines 追踪文件
+tracer = Tracer.from_env()
+
+_api_routes = set()
+
+@app.middleware("http")
+async def observe_requests(request: Request, call_next):
+    if not _api_routes:
+        _api_routes.update(r.path for r in app.routes)
+    # 只按已定义的路由分组，避免扫描器的随机路径撑爆标签
+    route = request.url.path if request.url.path in _api_routes else "other"
+    trace, reset = tracer.begin(force=request.headers.get("x-trace") == "1")
+    with http_in_flight.labels(route).track(), http_latency.time(route):
+        response = await call_next(request)
+    if trace:
+        response.headers["Server-Timing"] = trace.server_timing()
+        tracer.end(trace, reset, route, response.status_code)
+    return response
+
+# 初始化 OCR (配置了 OCR_SERVICE_SOCKET 时调用独立的识别服务进程)
+ocr = OcrClient.from_env()
+
+# ================= 冷启动预热 (函数计算) =================
+# 导入本模块时不加载 OCR 模型、bs4 与 pycryptodome (用到时才导入)，只查数据的冷启动不为它们付费。
+# FC 实例启动时调用初始化回调 POST /initialize，在后台线程预加载，不阻塞随后到达的请求。
+_warm_up_started = False
+
+def warm_up():
+    start = time.perf_counter()
+    try:
+        import bs4, Crypto.Cipher.AES, Crypto.Util.Padding
+        ocr.warm_up()
+        print(f"[warmup] 预加载完成，用时 {time.perf_counter() - start:.1f}s")
+    except Exception as e:
+        print(f"[warmup] 预加载失败 (首次使用时再加载): {e}")
 
-# 初始化 OCR
-ocr = ddddocr.DdddOcr(show_ad=False)
+@app.post("/initialize")
+async def initialize():
+    global _warm_up_started
+    if not _warm_up_started:
+        _warm_up_started = True
+        asyncio.get_running_loop().run_in_executor(None, warm_up)
+    return PlainTextResponse("")
 
 # ================= 配置区域 =================
 app.add_middleware(
@@ -43,42 +176,115 @@ app.add_middleware(
 # IN PRODUCTION: Retrieve this from environment variables!
 AES_SECRET_KEY = os.environ.get("AES_SECRET_KEY", "hbut_miniapp_secret_key_123456").encode('utf-8')[:32].ljust(32, b'\0')
 
+token_codec = TokenCodec(AES_SECRET_KEY)
+
 def encrypt_token(data: dict) -> str:
-    """Encrypt dictionary data into a token string"""
+    """Encrypt dictionary data into a token string (v2 format)"""
     try:
-        json_str = json.dumps(data)
-        iv = os.urandom(16)
-        cipher = AES.new(AES_SECRET_KEY, AES.MODE_CBC, iv)
-        encrypted = cipher.encrypt(pad(json_str.encode('utf-8'), AES.block_size))
-        # Return iv + encrypted data as base64
-        return base64.b64encode(iv + encrypted).decode('utf-8')
+        return token_codec.encode(data)
     except Exception as e:
         print(f"Token Encryption Failed: {e}")
         return ""
 
+# Decoded tokens are cached by a digest of the token string: the same token is
+# presented on every grades/timetable/rankings call. Invalid tokens are not
+# cached: a flood of distinct junk tokens would otherwise evict the valid ones,
+# and a failed v2 decode only costs a few microseconds.
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", 10000))
+TOKEN_CACHE_TTL = 600
+TOKEN_FAILURE_LOG_INTERVAL = 60
+token_cache = TTLCache(TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL)
+token_failures = {"total": 0, "unlogged": 0, "last_log": 0.0}
+
+def _log_token_failure(e: Exception):
+    """Count decrypt failures; print at most once per interval (bad tokens may come in floods)"""
+    token_failures["total"] += 1
+    token_decrypt_failures.labels().inc()
+    token_failures["unlogged"] += 1
+    now = time.monotonic()
+    if now - token_failures["last_log"] >= TOKEN_FAILURE_LOG_INTERVAL:
+        print(f"Token Decryption Failed x{token_failures['unlogged']} (last: {type(e).__name__}: {e})")
+        token_failures["unlogged"] = 0
+        token_failures["last_log"] = now
+
 def decrypt_token(token: str) -> dict:
-    """Decrypt token string back to dictionary"""
-    try:
-        raw = base64.b64decode(token)
-        iv = raw[:16]
-        encrypted = raw[16:]
-        cipher = AES.new(AES_SECRET_KEY, AES.MODE_CBC, iv)
-        decrypted = unpad(cipher.decrypt(encrypted), AES.block_size)
-        return json.loads(decrypted.decode('utf-8'))
-    except Exception as e:
-        print(f"Token Decryption Failed: {e}")
-        return None
+    """Decrypt token string (v2, or legacy v1) back to dictionary
 
-# URL 配置
-LOGIN_URL = "https://auth.hbut.edu.cn/authserver/login"
-CAPTCHA_URL = "https://auth.hbut.edu.cn/authserver/getCaptcha.htl"
-JW_HOME_URL = "https://hbut.jw.chaoxing.com/admin/login"
-TIMETABLE_PAGE_URL = "https://hbut.jw.chaoxing.com/admin/pkgl/xskb/queryKbForXsd"
-TIMETABLE_API_URL = "https://hbut.jw.chaoxing.com/admin/pkgl/xskb/sdpkkbList"
-CURRENT_WEEK_API_URL = "https://hbut.jw.chaoxing.com/admin/api/getXlzc"
-GRADE_API_URL = "https://hbut.jw.chaoxing.com/admin/xsd/xsdcjcx/xsdQueryXscjList"
-RANK_INFO_URL = "https://hbut.jw.chaoxing.com/admin/cjgl/xscjbbdy/printdgxscj"
-RANK_PAGE_URL = "https://hbut.jw.chaoxing.com/admin/cjgl/xscjbbdy/getXscjpm"
+    Returns a shallow copy of the cached dict, or None for an invalid token.
+    """
+    key = hashlib.blake2b(token.encode('utf-8'), digest_size=16).digest()
+    data = token_cache.get(key)
+    if data is None:
+        try:
+            data = token_codec.decode(token)
+            if not isinstance(data, dict): raise ValueError("token payload is not a dict")
+        except Exception as e:
+            _log_token_failure(e)
+            return None
+        token_cache.set(key, data)
+    return dict(data)
+
+# URL 配置 (CAS_BASE_URL / JW_BASE_URL 可指向本地模拟上游，见 bench/fake_upstream.py)
+CAS_BASE_URL = os.environ.get("CAS_BASE_URL", "https://auth.hbut.edu.cn").rstrip("/")
+JW_BASE_URL = os.environ.get("JW_BASE_URL", "https://hbut.jw.chaoxing.com").rstrip("/")
+LOGIN_URL = f"{CAS_BASE_URL}/authserver/login"
+CAPTCHA_URL = f"{CAS_BASE_URL}/authserver/getCaptcha.htl"
+JW_HOME_URL = f"{JW_BASE_URL}/admin/login"
+TIMETABLE_PAGE_URL = f"{JW_BASE_URL}/admin/pkgl/xskb/queryKbForXsd"
+TIMETABLE_API_URL = f"{JW_BASE_URL}/admin/pkgl/xskb/sdpkkbList"
+CURRENT_WEEK_API_URL = f"{JW_BASE_URL}/admin/api/getXlzc"
+GRADE_API_URL = f"{JW_BASE_URL}/admin/xsd/xsdcjcx/xsdQueryXscjList"
+RANK_INFO_URL = f"{JW_BASE_URL}/admin/cjgl/xscjbbdy/printdgxscj"
+RANK_PAGE_URL = f"{JW_BASE_URL}/admin/cjgl/xscjbbdy/getXscjpm"
+
+# token 只保存发往教务系统的 Cookie (按主机名匹配，不含端口)
+JW_HOST = urlsplit(JW_BASE_URL).hostname
+CAS_HOST = urlsplit(CAS_BASE_URL).hostname
+
+# 上游耗时指标按 URL 常量名分组 (不含查询参数)；重定向等其他地址归入 other
+UPSTREAM_ENDPOINTS = {
+    LOGIN_URL: "LOGIN_URL", CAPTCHA_URL: "CAPTCHA_URL", JW_HOME_URL: "JW_HOME_URL",
+    TIMETABLE_PAGE_URL: "TIMETABLE_PAGE_URL", TIMETABLE_API_URL: "TIMETABLE_API_URL",
+    CURRENT_WEEK_API_URL: "CURRENT_WEEK_API_URL", GRADE_API_URL: "GRADE_API_URL",
+    RANK_INFO_URL: "RANK_INFO_URL", RANK_PAGE_URL: "RANK_PAGE_URL",
+}
+
+def observe_upstream(url: str):
+    endpoint = UPSTREAM_ENDPOINTS.get(url, "other")
+    in_flight = upstream_in_flight.labels(endpoint)
+    in_flight.inc()
+    start = time.perf_counter()
+    def done(status):
+        in_flight.dec()
+        upstream_latency.labels(endpoint, status or "error").observe(time.perf_counter() - start)
+    return done
+
+set_observer(observe_upstream)
+
+# 自适应超时 + 对冲请求 (见 adaptive.py)。只对冲幂等的 GET；
+# 验证码不对冲：每次 GET 都会刷新 CAS 会话里的验证码答案，重复请求会让手里的图片作废
+HEDGE_RATIO = float(os.environ.get("HEDGE_RATIO", 0.05))
+upstream_hedges = metrics.counter("hbut_upstream_hedges_total", "对冲请求数 (won 为对冲请求先返回的次数)", ("result",))
+adaptive = AdaptiveTimeouts(
+    hedge_urls=(TIMETABLE_API_URL, RANK_PAGE_URL, CURRENT_WEEK_API_URL), hedge_ratio=HEDGE_RATIO,
+    on_hedge=lambda result: upstream_hedges.labels(result).inc()
+)
+set_adaptive(adaptive)
+
+# 上游熔断 (见 breaker.py)：连续失败后快速失败，成绩 / 课表 / 排名改为返回该学生最近一次成功的结果
+upstream_circuit_open = metrics.gauge("hbut_upstream_circuit_open", "熔断器未关闭 (open/half_open) 的 worker 数", ("host",))
+upstream_circuit_events = metrics.counter(
+    "hbut_upstream_circuit_events_total", "熔断器状态切换与熔断期间直接拒绝的请求数", ("host", "event"))
+stale_responses = metrics.counter("hbut_stale_responses_total", "熔断时返回旧数据的次数", ("route",))
+
+def on_circuit_event(host: str, event: str):
+    upstream_circuit_events.labels(host, event).inc()
+    if event != "rejected":
+        upstream_circuit_open.labels(host).set(0 if event == "closed" else 1)
+
+for _base in (CAS_BASE_URL, JW_BASE_URL):
+    upstream_circuit_open.labels(urlsplit(_base).netloc).set(0)
+set_breakers(CircuitBreakers.from_env(on_event=on_circuit_event))
 
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
@@ -92,7 +298,38 @@ KCXZ_MAP = {
     "99": "公共选修", "98": "重修", "16": "限选"
 }
 
-# 学期开始日期映射 (Hardcoded for stability)
+# 登录成功后最多跟随几次跳转来建立教务系统会话
+LOGIN_REDIRECT_LIMIT = 5
+
+# 自动登录：最多提交次数；每次提交前识别结果不可信时最多换几张验证码
+AUTO_LOGIN_ATTEMPTS = 3
+CAPTCHA_REROLLS = 2
+CAPTCHA_LENGTH = 4
+
+# 预热登录上下文池：上下文存活时间须短于 CAS execution / 验证码的有效期
+LOGIN_POOL_TTL = int(os.environ.get("LOGIN_POOL_TTL", 90))
+LOGIN_POOL_MIN = int(os.environ.get("LOGIN_POOL_MIN", 0))
+LOGIN_POOL_MAX = int(os.environ.get("LOGIN_POOL_MAX", 8))
+
+# 代理池 (PROXY_POOL_API / PROXY_LIST 未配置时直连)
+# 检测页为 CAS 登录页，页面里没有登录表单的 execution 字段即视为被防火墙拦截；
+# 每台机器只有一个 worker 负责检测，检测请求也计入 CAS 的限速额度
+proxy_pool = ProxyPool.from_env(LOGIN_URL, check_expect="execution", on_evict=discard_proxy, governor=governor)
+set_proxy_pool(proxy_pool)
+
+# 排名页解析时间预算 (毫秒)，超出后返回已解析到的部分
+RANK_PARSE_BUDGET_MS = float(os.environ.get("RANK_PARSE_BUDGET_MS", 50))
+
+# user_token 中数据的结构版本
+# 1: cookies / xhid / stu_id
+# 2: 增加 schema 与 sznj (入学年级)
+# 3: 增加 proxy (登录时绑定的代理，可选)
+# 4: 登录时不再查询 xhid / sznj，由课表 / 排名接口首次用到时查询并通过 user_token 写回
+TOKEN_SCHEMA = 4
+
+DEFAULT_XNXQ = "2025-2026-1"
+
+# 学期开始日期登记表的内置默认值；实际以 semesters.json (SEMESTER_CALENDAR_FILE) 为准，修改后自动生效
 # 格式: "学期代码": "YYYY-MM-DD" (必须是周一)
 SEMESTER_START_DATES = {
     "2024-2025-1": "2024-09-02",
@@ -101,6 +338,62 @@ SEMESTER_START_DATES = {
     "2025-2026-2": "2026-02-23" # Estimate
 }
 
+# 校历：登记表中的学期直接计算当前周，其余学期用 getXlzc (每天只查一次，所有 worker 共享)
+academic_calendar = AcademicCalendar.from_env(SEMESTER_START_DATES)
+
+# 成绩行指纹索引 (按 stu_id + version)，用于 /api/grades 增量同步
+GRADE_INDEX_MAX_BYTES = int(os.environ.get("GRADE_INDEX_MAX_BYTES", 32 * 1024 * 1024))
+GRADE_INDEX_TTL = 30 * 24 * 3600
+grade_index = SWRCache(GRADE_INDEX_MAX_BYTES)
+
+# 课表缓存 (按 stu_id + xhid + xnxq)
+# 往期学期课表不会再变，缓存很久；当前/未来学期只缓存几个小时
+TIMETABLE_CACHE_MAX_BYTES = int(os.environ.get("TIMETABLE_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+TIMETABLE_TTL_PAST = 7 * 24 * 3600
+TIMETABLE_TTL_CURRENT = 6 * 3600
+TIMETABLE_STALE_TTL = 7 * 24 * 3600
+timetable_cache = SWRCache(TIMETABLE_CACHE_MAX_BYTES)
+
+# 最近一次成功的解析结果 (成绩按 stu_id，课表 / 排名按 stu_id + 学期)
+# 只在上游熔断时使用，所以保存得比正常缓存久得多
+LAST_GOOD_MAX_BYTES = int(os.environ.get("LAST_GOOD_MAX_BYTES", 64 * 1024 * 1024))
+LAST_GOOD_TTL = 30 * 24 * 3600
+last_good = SWRCache(LAST_GOOD_MAX_BYTES)
+
+def remember_good(key, result: dict):
+    last_good.set(key, (result, int(time.time())), LAST_GOOD_TTL)
+
+def stale_fallback(route: str, key) -> Optional[tuple]:
+    """熔断时取旧结果，返回 (result, updated_at)；没有时返回 None"""
+    good, _ = last_good.get(key)
+    if good is None:
+        return None
+    stale_responses.labels(route).inc()
+    return good[0], good[1]
+
+# 会话过期时教务系统返回的是登录页 (脚本跳转到 /admin/login 或统一认证)，而不是数据
+_LOGIN_PAGE_RE = re.compile(r"location\.href\s*=\s*['\"][^'\"]*/admin/login|/authserver/login")
+
+def raise_for_upstream(resp):
+    """5xx 是上游故障而不是会话过期：抛出 UpstreamUnavailable (接口返回旧数据或 503)，不让客户端删掉 token"""
+    if resp.status_code >= 500:
+        raise UpstreamUnavailable(f"{resp.url.path} 返回 {resp.status_code}")
+
+def mark_stale(response: dict, updated_at: int) -> dict:
+    response["stale"] = True
+    response["updated_at"] = updated_at
+    return response
+
+# 相同学生的相同上游请求并发时只发一次 (成绩 / 课表 / 排名)
+upstream_flight = SingleFlight()
+
+def timetable_cache_ttl(xnxq: str):
+    """返回 (ttl, stale_ttl)"""
+    current = academic_calendar.current_semester()
+    if current and xnxq < current:
+        return TIMETABLE_TTL_PAST, TIMETABLE_STALE_TTL
+    return TIMETABLE_TTL_CURRENT, TIMETABLE_STALE_TTL
+
 # ================= 数据模型 =================
 class LoginRequest(BaseModel):
     username: str
@@ -108,12 +401,13 @@ class LoginRequest(BaseModel):
     token: Optional[str] = None
     captcha: Optional[str] = None 
 
-class TokenRequest(BaseModel):
+class GradesRequest(BaseModel):
     token: str
+    version: Optional[str] = None  # 客户端已缓存成绩的版本号，用于增量同步
 
 class TimetableRequest(BaseModel):
     token: str
-    xnxq: str = "2025-2026-1"
+    xnxq: str = DEFAULT_XNXQ
 
 class RankingRequest(BaseModel):
     token: str
@@ -122,6 +416,8 @@ class RankingRequest(BaseModel):
 
 # ================= 工具函数 =================
 def encrypt_password(password: str, salt: str) -> str:
+    from Crypto.Cipher import AES
+    from Crypto.Util.Padding import pad
     try:
         random_str = ''.join(random.choices(string.ascii_letters + string.digits, k=64))
         text = random_str + password
@@ -133,252 +429,471 @@ def encrypt_password(password: str, salt: str) -> str:
         print(f"加密失败: {e}")
         return None
 
-def strip_html(text: str) -> str:
-    if not text: return ""
-    try:
-        return BeautifulSoup(text, "html.parser").get_text(strip=True)
-    except:
-        return text
-
-def attempt_login(username, password, manual_captcha=None, session_data=None):
-    session = requests.Session()
-    session.headers.update(HEADERS)
-    execution, salt, lt, captcha_code = "", "", "", ""
-    snapshot = None
-
-    if manual_captcha and session_data:
-        session.cookies.update(session_data['cookies'])
-        execution = session_data['execution']
-        salt = session_data['salt']
-        lt = session_data['lt']
-        captcha_code = manual_captcha
-    else:
-        try:
-            resp = session.get(LOGIN_URL, timeout=5)
-            soup = BeautifulSoup(resp.text, 'html.parser')
-            execution = soup.find('input', {'name': 'execution'})['value']
-            salt = soup.find('input', {'id': 'pwdEncryptSalt'})['value']
-            lt_tag = soup.find('input', {'name': 'lt'})
-            lt = lt_tag['value'] if lt_tag else ""
-            
-            timestamp = int(time.time() * 1000)
-            captcha_resp = session.get(f"{CAPTCHA_URL}?{timestamp}", timeout=5)
-            img_bytes = captcha_resp.content
-            captcha_code = ocr.classification(img_bytes)
-            
-            snapshot = {
-                "cookies": session.cookies.get_dict(),
-                "execution": execution, "salt": salt, "lt": lt,
-                "img_b64": base64.b64encode(img_bytes).decode('utf-8')
-            }
-        except: return False, None, None
+LOGIN_FORM_FIELDS = {
+    "execution": ("name", "execution"), "salt": ("id", "pwdEncryptSalt"), "lt": ("name", "lt")
+}
+
+def parse_login_form(html: str) -> Optional[dict]:
+    """从 CAS 登录页提取 execution / salt / lt，找不到返回 None"""
+    form = find_input_values(html, LOGIN_FORM_FIELDS)
+    if "execution" in form and "salt" in form:
+        form.setdefault("lt", "")
+        return form
+
+    # 快速提取失败 (页面结构变化等)，回退到完整解析
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, 'html.parser')
+    exec_tag = soup.find('input', {'name': 'execution'})
+    salt_tag = soup.find('input', {'id': 'pwdEncryptSalt'})
+    if not exec_tag or not salt_tag: return None
+    lt_tag = soup.find('input', {'name': 'lt'})
+    return {
+        "execution": exec_tag['value'], "salt": salt_tag['value'],
+        "lt": lt_tag['value'] if lt_tag else ""
+    }
 
-    pwd = encrypt_password(password, salt)
+async def open_login_page(session: UpstreamSession, timeout=5) -> dict:
+    with span("cas_page"):
+        resp = await session.get(LOGIN_URL, timeout=timeout)
+    form = parse_login_form(resp.text)
+    if not form: raise ValueError("登录页缺少 execution")
+    return form
+
+async def fetch_captcha(session: UpstreamSession) -> bytes:
+    timestamp = int(time.time() * 1000)
+    with span("captcha"):
+        captcha_resp = await session.get(f"{CAPTCHA_URL}?{timestamp}", timeout=5)
+    return captcha_resp.content
+
+def captcha_plausible(code: str) -> bool:
+    """ddddocr 不给置信度，用长度与字符集判断识别结果是否可信"""
+    return bool(code) and len(code) == CAPTCHA_LENGTH and code.isascii() and code.isalnum()
+
+async def solve_captcha(session: UpstreamSession):
+    """获取并识别验证码；结果不可信时在同一会话内换一张再识别"""
+    for _ in range(CAPTCHA_REROLLS + 1):
+        img_bytes = await fetch_captcha(session)
+        # OCR 服务卡住时最多等到请求预算用完 (不足以识别时抛出 DeadlineExceeded)
+        timeout = session.deadline.timeout(OCR_CALL_TIMEOUT) if session.deadline else None
+        with ocr_latency.time(), span("ocr"):
+            captcha_code = await ocr.classify(img_bytes, timeout)
+        if captcha_plausible(captcha_code): break
+    return img_bytes, captcha_code
+
+async def fetch_xhid(session: UpstreamSession, xnxq: str) -> str:
+    """从课表页抓取 xhid；会话过期 (跳转 / 返回登录页) 返回空字符串
+
+    其他情况 (5xx、被拦截、页面结构变化) 抛出异常：不能让客户端以为登录失效而删掉 token
+    """
+    with span("xhid"):
+        tb_page = await session.get(TIMETABLE_PAGE_URL, params={"xnxq": xnxq}, timeout=10)
+    raise_for_upstream(tb_page)
+    if tb_page.is_redirect or _LOGIN_PAGE_RE.search(tb_page.text):
+        return ""
+    if not tb_page.is_success:
+        raise ValueError(f"课表页返回 {tb_page.status_code}")
+    xhid = find_input_values(tb_page.text, {"xhid": ("id", "xhid")}).get("xhid", "")
+    if not xhid:
+        from bs4 import BeautifulSoup
+        inp = BeautifulSoup(tb_page.text, 'html.parser').find('input', {'id': 'xhid'})
+        if inp: xhid = inp.get('value')
+    if not xhid:
+        raise ValueError("课表页中没有 xhid")
+    return xhid
+
+async def fetch_sznj(session: UpstreamSession, stu_id: str) -> Optional[str]:
+    """查询入学年级 (排名接口需要)，查无此人返回 None"""
+    with span("sznj"):
+        info_resp = await session.post(RANK_INFO_URL, data={"xsxh": stu_id}, timeout=5)
+    info_json = info_resp.json()
+    if info_json.get("ret") != 0 or not info_json.get("data", {}).get("records"):
+        return None
+    return info_json["data"]["records"][0]["sznj"]
+
+async def establish_jw_session(session: UpstreamSession, url: str):
+    """跟随登录成功后的 302 (CAS -> 教务系统 ?ticket=)，教务系统种下会话 Cookie 即停止
+
+    教务系统校验 ticket 后还会跳转到首页，首页对后续接口没有用，不再请求
+    """
+    for _ in range(LOGIN_REDIRECT_LIMIT):
+        with span("redirect"):
+            resp = await session.get(url, timeout=10)
+        if not resp.is_redirect: return
+        # 以教务系统的响应本身种下 Cookie 为准：会话里原有的 Cookie (如手动模式恢复的) 不算
+        if urlsplit(url).hostname == JW_HOST and resp.cookies: return
+        url = urljoin(url, resp.headers["Location"])
+
+async def submit_login(session: UpstreamSession, username, password, form: dict, captcha_code: str):
+    """提交登录表单，返回 (success, user_token 或失败原因, 失败页 HTML)"""
+    pwd = encrypt_password(password, form['salt'])
     payload = {
         "username": username, "password": pwd, "captcha": captcha_code,
         "_eventId": "submit", "cllt": "userNameLogin", "dllt": "generalLogin",
-        "lt": lt, "execution": execution
+        "lt": form['lt'], "execution": form['execution']
     }
 
     try:
-        login_resp = session.post(LOGIN_URL, data=payload, allow_redirects=False, timeout=10)
+        with span("submit"):
+            login_resp = await session.post(LOGIN_URL, data=payload, allow_redirects=False, timeout=10)
         if login_resp.status_code == 302:
-            redirect_url = login_resp.headers.get("Location")
-            session.get(redirect_url, allow_redirects=True)
-            session.get(JW_HOME_URL)
-            
-            # 抓取 xhid
-            xhid = ""
-            try:
-                tb_page = session.get(f"{TIMETABLE_PAGE_URL}?xnxq=2025-2026-1", timeout=10)
-                soup = BeautifulSoup(tb_page.text, 'html.parser')
-                inp = soup.find('input', {'id': 'xhid'})
-                if inp: xhid = inp.get('value')
-            except: pass
-
-            user_data = {
-                "cookies": session.cookies.get_dict(),
-                "xhid": xhid, "stu_id": username
-            }
+            # 只建立教务系统会话就签发 token；xhid / 入学年级由课表 / 排名接口首次用到时再查
+            await establish_jw_session(session, urljoin(LOGIN_URL, login_resp.headers.get("Location")))
+
+            # 数据接口只需要教务系统的 Cookie，统一认证的 Cookie 不写入 token
+            user_data = {"schema": TOKEN_SCHEMA, "cookies": session.get_dict(JW_HOST), "stu_id": username}
+            if session.proxy: user_data["proxy"] = session.proxy
             user_token = encrypt_token(user_data)
             return True, user_token, None
         else:
-            return False, "AuthFailed", snapshot
+            return False, "AuthFailed", login_resp.text
+    except (UpstreamBusy, DeadlineExceeded, CircuitOpen): raise
     except: return False, "NetworkError", None
 
+async def prepare_login_context() -> dict:
+    """预热一个登录上下文：登录页 + 验证码 + OCR 结果 (供 login_pool 使用)"""
+    session = UpstreamSession(HEADERS, priority=PRIORITY_CAPTCHA, proxy=proxy_pool.pick())
+    form = await open_login_page(session)
+    img_bytes, captcha_code = await solve_captcha(session)
+    return {"session": session, "form": form, "img_bytes": img_bytes, "captcha_code": captcha_code}
+
+login_pool = LoginContextPool(
+    prepare_login_context,
+    ttl=LOGIN_POOL_TTL, min_size=LOGIN_POOL_MIN, max_size=LOGIN_POOL_MAX
+)
+
+async def attempt_login(username, password, manual_captcha, session_data, deadline: Deadline):
+    """手动模式：使用 /api/captcha 或自动模式失败时保存的会话"""
+    # 临时 token 里只有统一认证的 Cookie，限定到 CAS 主机，登录后不会被当成教务系统 Cookie 写进 user_token
+    session = UpstreamSession(HEADERS, session_data['cookies'], priority=PRIORITY_LOGIN,
+                              proxy=proxy_pool.resolve(session_data.get("proxy")), deadline=deadline,
+                              cookie_domain=CAS_HOST)
+    form = {"execution": session_data['execution'], "salt": session_data['salt'], "lt": session_data['lt']}
+    success, result, _ = await submit_login(session, username, password, form, manual_captcha)
+    return success, result
+
+async def auto_login(username, password, deadline: Deadline):
+    """自动模式：在同一个 CAS 会话内重试，失败后只重新获取验证码
+
+    返回 (success, user_token, snapshot)，snapshot 用于回退到手动输入验证码；
+    剩余预算不够再试一轮时提前回退
+    """
+    session, form, prepared = None, None, None
+    ctx = login_pool.acquire()
+    if ctx:
+        session, form = ctx["session"], ctx["form"]
+        session.priority = PRIORITY_LOGIN
+        session.deadline = deadline
+        prepared = (ctx["img_bytes"], ctx["captcha_code"])
+
+    submits = 0
+    for i in range(AUTO_LOGIN_ATTEMPTS):
+        if i and not deadline.has(LOGIN_ATTEMPT_MIN_BUDGET):
+            deadline.skip("auto_login_retry")
+            break
+        try:
+            if form is None:
+                session = UpstreamSession(HEADERS, priority=PRIORITY_LOGIN, proxy=proxy_pool.pick(), deadline=deadline)
+                form = await open_login_page(session)
+            if prepared:
+                # 预热的上下文已带好验证码和识别结果，直接提交
+                img_bytes, captcha_code = prepared
+                prepared = None
+            else:
+                img_bytes, captcha_code = await solve_captcha(session)
+        except (UpstreamBusy, DeadlineExceeded, CircuitOpen): raise
+        except OcrUnavailable:
+            # 识别服务不可用：不再重试，换一张验证码交给用户手动输入
+            break
+        except:
+            form = None
+            continue
+
+        success, result, page = await submit_login(session, username, password, form, captcha_code)
+        if result != "NetworkError":
+            submits += 1
+            login_submits.labels(submits, "success" if success else "failed").inc()
+        if success: return True, result, None
+        if result == "NetworkError":
+            form = None
+            continue
+        # 失败页会带回新的 execution，沿用同一会话继续
+        form = (page and parse_login_form(page)) or form
+
+    if form is None: return False, None, None
+    # 自动识别全部失败：换一张新验证码交给用户手动输入
+    try:
+        img_bytes = await fetch_captcha(session)
+    except (UpstreamBusy, DeadlineExceeded, CircuitOpen): raise
+    except: return False, None, None
+    snapshot = {
+        "cookies": session.get_dict(), **form, "proxy": session.proxy,
+        "img_b64": base64.b64encode(img_bytes).decode('utf-8')
+    }
+    return False, None, snapshot
+
+def grades_delta(stu_id: str, data: list, client_version: Optional[str]) -> dict:
+    """成绩增量同步
+
+    - 客户端版本与当前一致：只返回 unchanged
+    - 服务端记得客户端版本的行指纹：只返回新增/变化的行 (upserts) 与删除的 id (removed)
+    - 否则返回全量 data
+    """
+    fingerprints = {}
+    for row in data:
+        raw = json.dumps(row, sort_keys=True, ensure_ascii=False).encode('utf-8')
+        fingerprints[row["id"]] = hashlib.md5(raw).hexdigest()[:16]
+    index_raw = "|".join(f"{k}:{v}" for k, v in sorted(fingerprints.items())).encode('utf-8')
+    version = hashlib.md5(index_raw).hexdigest()[:16]
+    grade_index.set((stu_id, version), fingerprints, GRADE_INDEX_TTL)
+
+    if client_version == version:
+        return {"code": 200, "unchanged": True, "version": version}
+    if client_version:
+        old, _ = grade_index.get((stu_id, client_version))
+        if old is not None:
+            upserts = [row for row in data if old.get(row["id"]) != fingerprints[row["id"]]]
+            removed = [k for k in old if k not in fingerprints]
+            return {"code": 200, "delta": True, "version": version, "upserts": upserts, "removed": removed}
+    return {"code": 200, "data": data, "version": version}
+
 # ================= API 接口 =================
 
 @app.get("/api/captcha")
-def get_captcha():
+async def get_captcha():
     # 仅用于手动模式刷新
-    session = requests.Session()
-    session.headers.update(HEADERS)
     try:
-        resp = session.get(LOGIN_URL, timeout=10)
-        soup = BeautifulSoup(resp.text, 'html.parser')
-        execution = soup.find('input', {'name': 'execution'})['value']
-        salt = soup.find('input', {'id': 'pwdEncryptSalt'})['value']
-        lt_tag = soup.find('input', {'name': 'lt'})
-        lt = lt_tag['value'] if lt_tag else ""
-
-        timestamp = int(time.time() * 1000)
-        captcha_resp = session.get(f"{CAPTCHA_URL}?{timestamp}", timeout=5)
-        b64_img = base64.b64encode(captcha_resp.content).decode('utf-8')
+        ctx = login_pool.acquire()
+        if ctx:
+            session, form, img_bytes = ctx["session"], ctx["form"], ctx["img_bytes"]
+        else:
+            session = UpstreamSession(HEADERS, priority=PRIORITY_CAPTCHA, proxy=proxy_pool.pick())
+            form = await open_login_page(session, timeout=10)
+            img_bytes = await fetch_captcha(session)
+        b64_img = base64.b64encode(img_bytes).decode('utf-8')
         
-        session_data = {
-            "cookies": session.cookies.get_dict(),
-            "execution": execution, "salt": salt, "lt": lt
-        }
+        session_data = {"cookies": session.get_dict(), **form}
+        if session.proxy: session_data["proxy"] = session.proxy
         temp_token = encrypt_token(session_data)
         return {"code": 200, "data": {"token": temp_token, "image": f"data:image/jpeg;base64,{b64_img}"}}
+    except UpstreamBusy:
+        return BUSY_RESPONSE
+    except CircuitOpen:
+        return UNAVAILABLE_RESPONSE
     except Exception as e:
         return {"code": 500, "msg": str(e)}
 
 @app.post("/api/login")
-def login(req: LoginRequest):
+async def login(req: LoginRequest):
+    deadline = Deadline(REQUEST_DEADLINE)
+    try:
+        result = with_skipped(await _login(req, deadline), deadline)
+    except UpstreamBusy:
+        result = BUSY_RESPONSE
+    except CircuitOpen:
+        result = UNAVAILABLE_RESPONSE
+    except DeadlineExceeded:
+        result = deadline_response(deadline)
+    mode = "manual" if req.token and req.captcha else "auto"
+    login_total.labels(mode, LOGIN_OUTCOMES.get(result["code"], "failed")).inc()
+    return result
+
+async def _login(req: LoginRequest, deadline: Deadline):
     if req.token and req.captcha:
         # 手动模式
         session_data = decrypt_token(req.token)
         if not session_data: return {"code": 400, "msg": "验证码或会话已过期"}
-        success, result, _ = attempt_login(req.username, req.password, req.captcha, session_data)
+        success, result = await attempt_login(req.username, req.password, req.captcha, session_data, deadline)
         if success: return {"code": 200, "user_token": result}
         return {"code": 401, "msg": "验证码或密码错误"}
     else:
         # 自动模式
-        last_snap = None
-        for i in range(3):
-            success, result, snap = attempt_login(req.username, req.password)
-            if success: return {"code": 200, "user_token": result}
-            if snap: last_snap = snap
-            time.sleep(0.5)
+        success, result, snap = await auto_login(req.username, req.password, deadline)
+        if success: return {"code": 200, "user_token": result}
         
-        if last_snap:
+        if snap:
             session_data = {
-                "cookies": last_snap['cookies'], "execution": last_snap['execution'],
-                "salt": last_snap['salt'], "lt": last_snap['lt']
+                "cookies": snap['cookies'], "execution": snap['execution'],
+                "salt": snap['salt'], "lt": snap['lt']
             }
+            if snap['proxy']: session_data["proxy"] = snap['proxy']
             t_token = encrypt_token(session_data)
-            return {"code": 429, "msg": "自动识别失败，请手动输入", "data": {"token": t_token, "image": f"data:image/jpeg;base64,{last_snap['img_b64']}"}}
+            return {"code": 429, "msg": "自动识别失败，请手动输入", "data": {"token": t_token, "image": f"data:image/jpeg;base64,{snap['img_b64']}"}}
         return {"code": 500, "msg": "登录失败"}
 
-@app.post("/api/grades")
-def query_grades(req: TokenRequest):
-    user_data = decrypt_token(req.token)
-    if not user_data: return {"code": 401, "msg": "请重新登录"}
-    
-    session = requests.Session()
-    session.headers.update(HEADERS)
-    session.cookies.update(user_data['cookies'])
+async def fetch_grades(user_data: dict, deadline: Optional[Deadline] = None) -> dict:
+    """从教务系统拉取全部成绩；成功返回 {"code": 200, "data": [...]}"""
+    session = UpstreamSession(HEADERS, user_data['cookies'], proxy=proxy_pool.resolve(user_data.get("proxy")),
+                              deadline=deadline)
     
     payload = {
         "fxbz": "0", "gridtype": "jqgrid", "page.pn": "1", "page.size": "500",
         "sort": "xnxq", "order": "desc",
         "queryFields": "id,xnxq,kcmc,xf,kcxz,cjfxms,zhcj,xdxz"
     }
+    with span("grades"):
+        resp = await session.post(GRADE_API_URL, data=payload, timeout=10)
+    raise_for_upstream(resp)
+    if "text/html" in resp.headers.get("Content-Type", ""):
+        return {"code": 401, "msg": "会话过期"}
+        
+    res_list = resp.json().get("results", [])
+    data = []
+    for item in res_list:
+        data.append({
+            "id": item.get("id") or f"{item.get('xnxq')}:{item.get('kcmc')}",
+            "semester": item.get("xnxq"),
+            "course_name": item.get("kcmc"),
+            "credit": item.get("xf"),
+            "score": item.get("zhcj"),
+            "type": KCXZ_MAP.get(str(item.get("kcxz")), "其他"),
+            "is_retake": str(item.get("xdxz")) == "2"
+        })
+    return {"code": 200, "data": data}
+
+@app.post("/api/grades")
+async def query_grades(req: GradesRequest):
+    user_data = decrypt_token(req.token)
+    if not user_data: return {"code": 401, "msg": "请重新登录"}
+    
+    deadline = Deadline(REQUEST_DEADLINE)
+    stu_id = user_data.get("stu_id")
     try:
-        resp = session.post(GRADE_API_URL, data=payload, timeout=10)
-        if "text/html" in resp.headers.get("Content-Type", ""):
-            return {"code": 401, "msg": "会话过期"}
-            
-        res_list = resp.json().get("results", [])
-        data = []
-        for item in res_list:
-            data.append({
-                "semester": item.get("xnxq"),
-                "course_name": item.get("kcmc"),
-                "credit": item.get("xf"),
-                "score": item.get("zhcj"),
-                "type": KCXZ_MAP.get(str(item.get("kcxz")), "其他"),
-                "is_retake": str(item.get("xdxz")) == "2"
-            })
-        return {"code": 200, "data": data}
+        result = await upstream_flight.do(("grades", stu_id), lambda: fetch_grades(user_data, deadline))
+        if result["code"] != 200: return result
+        remember_good(("grades", stu_id), result)
+        return grades_delta(stu_id, result["data"], req.version)
+    except UpstreamBusy:
+        return BUSY_RESPONSE
+    except UpstreamUnavailable:
+        stale = stale_fallback("grades", ("grades", stu_id))
+        if stale is None: return UNAVAILABLE_RESPONSE
+        return mark_stale(grades_delta(stu_id, stale[0]["data"], req.version), stale[1])
+    except DeadlineExceeded:
+        return deadline_response(deadline)
     except Exception as e:
         return {"code": 500, "msg": str(e)}
 
+async def fetch_rank_page(session: UpstreamSession, params: dict) -> dict:
+    """成功返回 {"code": 200, "data": ..., "partial": [...], "found": bool}
+
+    partial 为结果不完整的原因，single-flight 的每个调用方都据此标记 skipped；
+    found 表示页面里确实找到了 GPA 或排名行 (找不到时不能当作该学生的有效结果保存)
+    """
+    # 边下载边解析，找齐 GPA / 平均分 / 排名后立即断开，不再读取剩余页面
+    parser = RankPageParser(RANK_PARSE_BUDGET_MS)
+    partial = []
+    login_page = False
+    with span("rank_page"):
+        async with session.stream("GET", RANK_PAGE_URL, params=params, timeout=10) as html_resp:
+            raise_for_upstream(html_resp)
+            if html_resp.is_redirect:
+                return {"code": 401, "msg": "会话过期"}
+            async for chunk in html_resp.aiter_text():
+                if not login_page and _LOGIN_PAGE_RE.search(chunk):
+                    login_page = True
+                if parser.feed(chunk): break
+                if session.deadline and session.deadline.remaining() <= 0:
+                    # 预算用完仍未读完：返回已解析到的部分
+                    partial.append("rank_page_tail")
+                    break
+        parser.close()
+    found = parser.gpa is not None or parser.ranks is not None
+    if login_page and not found:
+        return {"code": 401, "msg": "会话过期"}
+    if parser.over_budget:
+        partial.append("rank_parse_budget")
+    return {"code": 200, "data": parser.result(), "partial": partial, "found": found}
+
 @app.post("/api/rankings")
-def get_rankings(req: RankingRequest):
+async def get_rankings(req: RankingRequest):
     user_data = decrypt_token(req.token)
     if not user_data: return {"code": 401, "msg": "登录已失效"}
     
-    session = requests.Session()
-    session.headers.update(HEADERS)
-    session.cookies.update(user_data['cookies'])
+    stu_id = user_data.get("stu_id")
+    own = stu_id == req.username
+    deadline = Deadline(REQUEST_DEADLINE)
+    session = UpstreamSession(HEADERS, user_data['cookies'], proxy=proxy_pool.resolve(user_data.get("proxy")),
+                              deadline=deadline)
 
     try:
-        # Step 1: 查年级信息
-        info_resp = session.post(RANK_INFO_URL, data={"xsxh": req.username}, timeout=5)
-        info_json = info_resp.json()
-        
-        if info_json.get("ret") != 0 or not info_json.get("data", {}).get("records"):
-            return {"code": 404, "msg": "未找到学生信息"}
-            
-        student_info = info_json["data"]["records"][0]
-        sznj = student_info["sznj"]
+        # Step 1: 入学年级优先取 token 中保存的值 (旧 token 没有，查询后写回新 token)
+        new_token = None
+        sznj = user_data.get("sznj") if user_data.get("stu_id") == req.username else None
+        if not sznj:
+            sznj = await fetch_sznj(session, req.username)
+            if not sznj: return {"code": 404, "msg": "未找到学生信息"}
+            if user_data.get("stu_id") == req.username:
+                new_token = encrypt_token({**user_data, "schema": TOKEN_SCHEMA, "sznj": sznj})
         
         # Step 2: 拉取 HTML
         target_semester = req.semester if req.semester != "all" else ""
         params = {"xh": req.username, "sznj": sznj, "xnxq": target_semester}
         
-        html_resp = session.get(RANK_PAGE_URL, params=params, timeout=10)
-        soup = BeautifulSoup(html_resp.text, 'html.parser')
-        
-        res = {"gpa": "无", "class_rank": "无", "major_rank": "无", "avg_score": "无", "fail_count": "0"}
-
-        # 提取顶部摘要信息
-        all_text = soup.get_text()
-        gpa_match = re.search(r"平均学分绩点\s*[：:]\s*([0-9.]+)", all_text)
-        if gpa_match: res["gpa"] = gpa_match.group(1)
-        avg_match = re.search(r"算术平均分\s*[：:]\s*([0-9.]+)", all_text)
-        if avg_match: res["avg_score"] = avg_match.group(1)
-
-        # 提取底部表格排名
-        rows = soup.find_all("tr")
-        for tr in rows:
-            cells = tr.find_all("td")
-            if not cells: continue
-            cell_texts = [td.get_text(strip=True) for td in cells]
-            if len(cell_texts) >= 4 and cell_texts[0] == "平均学分绩点":
-                res["major_rank"] = cell_texts[2]
-                res["class_rank"] = cell_texts[3]
-                break
-
-        return {"code": 200, "data": res}
+        # key 带上 token 本人的学号：拿别人的 token 发起的请求不能共享本人的结果 (用的是各自的会话)
+        page = await upstream_flight.do(
+            ("rankings", stu_id, req.username, sznj, target_semester),
+            lambda: fetch_rank_page(session, params)
+        )
+
+        if page["code"] != 200: return page
+        for step in page["partial"]:
+            deadline.skip(step)
+        # 只保存 / 返回 token 本人的旧排名，不能借别人的学号读写；页面里什么都没找到的结果不保存
+        if own and page["found"] and not deadline.skipped:
+            remember_good(("rankings", stu_id, target_semester), {"code": 200, "data": page["data"]})
+        result = {"code": 200, "data": page["data"]}
+        if new_token: result["user_token"] = new_token
+        return with_skipped(result, deadline)
+    except UpstreamBusy:
+        return BUSY_RESPONSE
+    except UpstreamUnavailable:
+        target_semester = req.semester if req.semester != "all" else ""
+        stale = stale_fallback("rankings", ("rankings", stu_id, target_semester)) if own else None
+        if stale is None: return UNAVAILABLE_RESPONSE
+        return mark_stale(dict(stale[0]), stale[1])
+    except DeadlineExceeded:
+        return deadline_response(deadline)
     except Exception as e:
         traceback.print_exc()
         return {"code": 500, "msg": "排名获取失败"}
 
-@app.post("/api/timetable")
-def query_timetable(req: TimetableRequest):
-    user_data = decrypt_token(req.token)
-    if not user_data: return {"code": 401, "msg": "请重新登录"}
-    xhid = user_data.get("xhid")
-    if not xhid: return {"code": 403, "msg": "缺少 xhid"}
-
-    session = requests.Session()
-    session.headers.update(HEADERS)
-    session.cookies.update(user_data['cookies'])
-    
-    try:
-        # 1. 获取当前周
-        current_week = 1 
-        try:
-            week_resp = session.get(CURRENT_WEEK_API_URL, timeout=5)
-            if week_resp.json().get("ret") == 0:
-                current_week = int(week_resp.json()['data'].get('xlzc', 1))
-        except: pass
-
-        # 2. 获取数据
-        params = {"xnxq": req.xnxq, "xhid": xhid, "xqdm": "1", "xskbxslx": "0"}
-        resp = session.get(TIMETABLE_API_URL, params=params, timeout=10)
+async def fetch_upstream_week(user_data: dict, deadline: Optional[Deadline] = None) -> int:
+    """教务系统的当前周 (getXlzc)，由 academic_calendar 每天调用一次"""
+    session = UpstreamSession(HEADERS, user_data['cookies'], proxy=proxy_pool.resolve(user_data.get("proxy")),
+                              deadline=deadline)
+    with span("week"):
+        week_resp = await session.get(CURRENT_WEEK_API_URL, timeout=5)
+    week_json = week_resp.json()
+    if week_json.get("ret") != 0:
+        raise ValueError(f"getXlzc 返回 {week_json.get('ret')}")
+    return int(week_json['data'].get('xlzc', 1))
+
+async def resolve_xhid(user_data: dict, xnxq: str, deadline: Optional[Deadline] = None) -> str:
+    session = UpstreamSession(HEADERS, user_data['cookies'], proxy=proxy_pool.resolve(user_data.get("proxy")),
+                              deadline=deadline)
+    return await fetch_xhid(session, xnxq)
+
+async def fetch_timetable(user_data: dict, xnxq: str, deadline: Optional[Deadline] = None) -> dict:
+    """从教务系统拉取并合并课表；成功返回 {"code": 200, "data": ...}"""
+    session = UpstreamSession(HEADERS, user_data['cookies'], proxy=proxy_pool.resolve(user_data.get("proxy")),
+                              deadline=deadline)
+
+    # 1. 获取数据 (当前周由 academic_calendar 提供，不再每次请求 getXlzc)
+    with span("data"):
+        params = {"xnxq": xnxq, "xhid": user_data.get("xhid"), "xqdm": "1", "xskbxslx": "0"}
+        resp = await session.get(TIMETABLE_API_URL, params=params, timeout=10)
+        raise_for_upstream(resp)
         if "text/html" in resp.headers.get("Content-Type", ""):
             return {"code": 401, "msg": "会话过期"}
 
         json_data = resp.json()
         raw_list = json_data.get("data", [])
-        
-        # 3. 预处理
+    
+    # 2. 预处理
+    with span("clean"):
         processed_list = []
-        for item in raw_list:
+        cleaned = clean_rows(raw_list, ("kcmc", "croommc", "tmc"))
+        for item, (name, room, teacher) in zip(raw_list, cleaned):
             zcstr = item.get("zcstr", "")
             weeks_list = []
             if zcstr:
@@ -388,11 +903,11 @@ def query_timetable(req: TimetableRequest):
             start_sec = int(item.get("djc", 1))
             end_sec = int(item.get("djs", start_sec))
             step_span = max(1, end_sec - start_sec + 1)
-            
+        
             processed_list.append({
-                "name": strip_html(item.get("kcmc")),
-                "room": strip_html(item.get("croommc")),
-                "teacher": strip_html(item.get("tmc")),
+                "name": name,
+                "room": room,
+                "teacher": teacher,
                 "weeks_desc": item.get("zc"),       
                 "weeks_list": weeks_list,           
                 "day": int(item.get("xingqi", 0)),  
@@ -402,10 +917,11 @@ def query_timetable(req: TimetableRequest):
                 "pkid": item.get("pkid", "")
             })
 
-        # 4. 合并算法
+    # 3. 合并算法
+    with span("merge"):
         processed_list.sort(key=lambda x: (x['day'], x['start']))
         merged_list = []
-        
+    
         if processed_list:
             current = processed_list[0]
             for next_item in processed_list[1:]:
@@ -417,7 +933,7 @@ def query_timetable(req: TimetableRequest):
                     current['raw_zc'] == next_item['raw_zc']
                 )
                 is_cont = (current['start'] + current['step']) == next_item['start']
-                
+            
                 if is_same and is_cont:
                     current['step'] += next_item['step']
                 else:
@@ -425,32 +941,82 @@ def query_timetable(req: TimetableRequest):
                     current = next_item
             merged_list.append(current)
 
-        # 4. 获取/计算学期开始日期与当前周
-        today = datetime.date.today()
-        start_date_str = SEMESTER_START_DATES.get(req.xnxq)
-        
-        # 如果有硬编码的开始日期，优先使用它来计算 Current Week
-        # 因为学校接口在假期往往返回错误的周次 (e.g. 1)
-        if start_date_str:
-            start_date = datetime.datetime.strptime(start_date_str, "%Y-%m-%d").date()
-            days_diff = (today - start_date).days
-            if days_diff >= 0:
-                current_week = (days_diff // 7) + 1
+    return {"code": 200, "data": merged_list}
+
+@app.post("/api/timetable")
+async def query_timetable(req: TimetableRequest):
+    user_data = decrypt_token(req.token)
+    if not user_data: return {"code": 401, "msg": "请重新登录"}
+
+    deadline = Deadline(REQUEST_DEADLINE)
+    try:
+        stu_id = user_data.get("stu_id")
+        good_key = ("timetable", stu_id, req.xnxq)
+        ttl, stale_ttl = timetable_cache_ttl(req.xnxq)
+        new_token, updated_at = None, None
+        try:
+            # xhid 不在登录时查询：首次查课表时从课表页获取，写入新 token 返回，之后不再查
+            xhid = user_data.get("xhid")
+            if not xhid:
+                xhid = await upstream_flight.do(("xhid", stu_id), lambda: resolve_xhid(user_data, req.xnxq, deadline))
+                if not xhid: return {"code": 401, "msg": "会话过期"}
+                user_data = {**user_data, "schema": TOKEN_SCHEMA, "xhid": xhid}
+                new_token = encrypt_token(user_data)
+
+            cache_key = (stu_id, xhid, req.xnxq)
+            result, state = timetable_cache.get(cache_key)
+            flight_key = ("timetable",) + cache_key
+            if result is None:
+                result = await upstream_flight.do(flight_key, lambda: fetch_timetable(user_data, req.xnxq, deadline))
+                if result["code"] != 200: return result
+                timetable_cache.set(cache_key, result, ttl, stale_ttl)
+                remember_good(good_key, result)
+            elif state == STALE:
+                # 先返回旧课表，后台刷新
+                async def reload():
+                    fresh = await upstream_flight.do(flight_key, lambda: fetch_timetable(user_data, req.xnxq))
+                    if fresh["code"] != 200: return None
+                    remember_good(good_key, fresh)
+                    return fresh
+                timetable_cache.revalidate(cache_key, reload, ttl, stale_ttl)
+        except UpstreamUnavailable:
+            stale = stale_fallback("timetable", good_key)
+            if stale is None: return UNAVAILABLE_RESPONSE
+            result, updated_at = stale
+
+        # 4. 当前周：登记表中有开学日期时直接计算
+        # 因为学校接口在假期往往返回错误的周次 (e.g. 1)；没有时才用 getXlzc (每天一次)
+        start_date = academic_calendar.start_date(req.xnxq)
+        start_date_str = start_date.isoformat() if start_date else None
+        current_week = academic_calendar.week_of(req.xnxq)
+        if current_week is None:
+            if deadline.has(OPTIONAL_STEP_MIN_BUDGET):
+                current_week = await academic_calendar.upstream_week(lambda: fetch_upstream_week(user_data, deadline)) or 1
             else:
-                # 还没开学
+                deadline.skip("current_week")
                 current_week = 1
         
-        return {
+        response = with_skipped({
             "code": 200, 
-            "data": merged_list, 
+            "data": result["data"], 
             "current_week": current_week,
             "semester": req.xnxq,
             "start_date": start_date_str # Return this to frontend
-        }
+        }, deadline)
+        if new_token: response["user_token"] = new_token
+        return mark_stale(response, updated_at) if updated_at else response
         
+    except UpstreamBusy:
+        return BUSY_RESPONSE
+    except DeadlineExceeded:
+        return deadline_response(deadline)
     except Exception as e:
         return {"code": 500, "msg": f"失败: {str(e)}"}
 
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""Prometheus 文本格式的指标 (跨 gunicorn worker 汇总)
+
+每个 worker 在内存中累计自己的指标，并定期把快照写到 METRICS_DIR/worker-<pid>.json；
+/metrics 由任意一个 worker 响应：自身用实时值，其他 worker 读快照文件后相加。
+- Counter / Histogram：已退出 worker 的快照继续计入 (保持单调递增)
+- Gauge：只统计仍存活的 worker
+gunicorn 启动时清空 METRICS_DIR (见 gunicorn_config.py)；未配置时只输出本进程的指标。
+"""
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values = {}  # 标签值元组 -> 值
+        self._lock = threading.Lock()
+
+    def labels(self, *values) -> "_Child":
+        return _Child(self, tuple(str(v) for v in values))
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            values = [[list(k), v if not isinstance(v, list) else list(v)] for k, v in self._values.items()]
+        return {"kind": self.kind, "help": self.help, "labels": list(self.label_names), "values": values}
+
+class _Child:
+    __slots__ = ("metric", "key")
+
+    def __init__(self, metric: _Metric, key: tuple):
+        self.metric = metric
+        self.key = key
+
+    def inc(self, amount: float = 1):
+        self.metric._add(self.key, amount)
+
+    def dec(self, amount: float = 1):
+        self.metric._add(self.key, -amount)
+
+    def set(self, value: float):
+        self.metric._set(self.key, value)
+
+    def observe(self, value: float):
+        self.metric._observe(self.key, value)
+
+    def track(self):
+        """with gauge.labels(...).track(): 在途计数 +1，退出时 -1"""
+        return _Tracker(self)
+
+class _Tracker:
+    __slots__ = ("child",)
+
+    def __init__(self, child: _Child):
+        self.child = child
+
+    def __enter__(self):
+        self.child.inc()
+
+    def __exit__(self, *exc):
+        self.child.dec()
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _add(self, key, amount):
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def _set(self, key, value):
+        with self._lock:
+            self._values[key] = value
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def _observe(self, key, value):
+        # 值布局：[各桶计数 (不累积)..., +Inf 桶, sum]
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            slot = self._values.get(key)
+            if slot is None:
+                slot = self._values[key] = [0] * (len(self.buckets) + 2)
+            slot[idx] += 1
+            slot[-1] += value
+
+    def snapshot(self) -> dict:
+        snap = super().snapshot()
+        snap["buckets"] = list(self.buckets)
+        return snap
+
+    def time(self, *values):
+        return _Timer(self.labels(*values))
+
+class _Timer:
+    __slots__ = ("child", "start")
+
+    def __init__(self, child: _Child):
+        self.child = child
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.start)
+
+class Registry:
+    def __init__(self, directory: str = None):
+        self.directory = directory
+        self._metrics = {}
+        self._collectors = []
+
+    @classmethod
+    def from_env(cls):
+        return cls(os.environ.get("METRICS_DIR") or None)
+
+    def _register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()) -> Counter:
+        return self._register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()) -> Gauge:
+        return self._register(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def add_collector(self, func):
+        """func() 返回已在全局汇总好的指标文本行 (如共享内存里的限速状态)，不参与跨 worker 相加"""
+        self._collectors.append(func)
+
+    def snapshot(self) -> dict:
+        return {name: m.snapshot() for name, m in self._metrics.items()}
+
+    # ---------- 跨 worker ----------
+    def _path(self, pid: int) -> str:
+        return os.path.join(self.directory, f"worker-{pid}.json")
+
+    def flush(self):
+        """把本进程快照写入共享目录 (先写临时文件再改名，读者不会读到半个文件)"""
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(os.getpid())
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+
+    def _peer_snapshots(self):
+        if not self.directory or not os.path.isdir(self.directory):
+            return
+        for fname in os.listdir(self.directory):
+            if not (fname.startswith("worker-") and fname.endswith(".json")):
+                continue
+            pid = int(fname[7:-5])
+            if pid == os.getpid():
+                continue
+            try:
+                with open(os.path.join(self.directory, fname), encoding="utf-8") as f:
+                    yield _pid_alive(pid), json.load(f)
+            except (OSError, ValueError):
+                continue
+
+    def collect(self) -> dict:
+        """合并本进程实时值与其他 worker 的快照"""
+        merged = self.snapshot()
+        for name, snap in merged.items():
+            snap["values"] = {tuple(k): v for k, v in snap["values"]}
+        for alive, peer in self._peer_snapshots():
+            for name, snap in peer.items():
+                own = merged.get(name)
+                if own is None or own["kind"] != snap["kind"] or (own["kind"] == "gauge" and not alive):
+                    continue
+                for key, value in snap["values"]:
+                    key = tuple(key)
+                    cur = own["values"].get(key)
+                    if isinstance(value, list):
+                        if cur is None or len(cur) != len(value):
+                            own["values"][key] = list(value) if cur is None else cur
+                        else:
+                            own["values"][key] = [a + b for a, b in zip(cur, value)]
+                    else:
+                        own["values"][key] = (cur or 0) + value
+        return merged
+
+    def render(self) -> str:
+        lines = []
+        for name, snap in self.collect().items():
+            lines.append(f"# HELP {name} {snap['help']}")
+            lines.append(f"# TYPE {name} {snap['kind']}")
+            for key, value in sorted(snap["values"].items()):
+                labels = list(zip(snap["labels"], key))
+                if snap["kind"] != "histogram":
+                    lines.append(f"{name}{_fmt_labels(labels)} {_fmt(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(snap["buckets"] + ["+Inf"], value[:-1]):
+                    cumulative += count
+                    le = bound if bound == "+Inf" else _fmt(bound)
+                    lines.append(f"{name}_bucket{_fmt_labels(labels + [('le', le)])} {cumulative}")
+                lines.append(f"{name}_sum{_fmt_labels(labels)} {_fmt(value[-1])}")
+                lines.append(f"{name}_count{_fmt_labels(labels)} {cumulative}")
+        for func in self._collectors:
+            try:
+                lines.extend(func())
+            except Exception:
+                pass
+        return "\n".join(lines) + "\n"
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+def _fmt(value) -> str:
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+def _fmt_labels(pairs) -> str:
+    if not pairs:
+        return ""
+    body = ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in pairs)
+    return "{" + body + "}"
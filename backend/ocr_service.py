@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+"""验证码识别服务
+
+ddddocr 模型 (onnxruntime) 只在一个独立进程中加载一次，各 gunicorn worker 通过本地
+Unix socket 调用，不再每个 worker 各占一份模型内存，也不会在请求线程里跑 CPU 推理。
+服务端把同一时间窗内到达的请求攒成一批，交给推理线程集中处理 (micro-batching)。
+
+启动: python ocr_service.py --socket /tmp/hbut-ocr.sock
+(gunicorn_config.py 会在 master 启动时自动拉起、等 socket 就绪后再启动 worker，并设置 OCR_SERVICE_SOCKET)
+未配置 OCR_SERVICE_SOCKET 时 (如 FC 单进程部署)，在进程内加载模型。
+配置了服务但服务不可用时，本次识别失败 (抛出 OcrUnavailable，登录改为手动输入验证码)，
+worker 不会自己加载模型，否则每个 worker 又各占一份模型内存。
+
+客户端每个 worker 保持最多 OCR_CLIENT_CONNECTIONS 条长连接，连接上的请求依次处理。
+推理线程数 OCR_THREADS 默认 1：onnxruntime 本身会用多核，多线程并发推理未必更快，
+调整前先用 bench/bench_ocr.py 在目标机器上对比。
+
+协议: 请求 = 1 字节操作码 + 4 字节长度 (大端) + 负载；响应 = 4 字节长度 + JSON
+"""
+import argparse
+import asyncio
+import json
+import os
+import struct
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+OP_CLASSIFY = b"C"
+OP_STATS = b"S"
+
+MAX_BATCH = int(os.environ.get("OCR_MAX_BATCH", 16))
+BATCH_WINDOW = float(os.environ.get("OCR_BATCH_WINDOW_MS", 2)) / 1000
+OCR_THREADS = int(os.environ.get("OCR_THREADS", 1))
+BACKLOG = 1024
+CLIENT_CONNECTIONS = int(os.environ.get("OCR_CLIENT_CONNECTIONS", 4))
+CONNECT_TIMEOUT = 3
+# 一次识别 (排队等连接 + 发送 + 等待结果) 的超时：服务卡住时不让登录一直挂着
+CALL_TIMEOUT = float(os.environ.get("OCR_CALL_TIMEOUT", 5))
+UNAVAILABLE_LOG_INTERVAL = 60
+
+class OcrUnavailable(Exception):
+    """识别服务不可用或超时，本次识别失败"""
+
+def load_model():
+    import ddddocr
+    from PIL import Image
+    # 修复 Pillow 兼容性
+    if not hasattr(Image, 'ANTIALIAS'):
+        Image.ANTIALIAS = Image.Resampling.LANCZOS
+    return ddddocr.DdddOcr(show_ad=False)
+
+def classify_batch(model, images: list) -> list:
+    """依次识别一批图片，返回 [{"text": ...} 或 {"error": ...}]
+
+    ddddocr 自带模型的输入 batch 维固定为 1，无法拼成一个张量推理，
+    因此一批请求在同一推理线程内连续执行，省去逐个调度的开销。
+    """
+    results = []
+    for img in images:
+        try:
+            results.append({"text": model.classification(img)})
+        except Exception as e:
+            results.append({"error": str(e)})
+    return results
+
+class LatencyWindow:
+    """最近 N 次耗时 (ms)，用于计算分位数"""
+    def __init__(self, size: int = 1000):
+        self._values = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, ms: float):
+        with self._lock:
+            self._values.append(ms)
+
+    def summary(self) -> dict:
+        with self._lock:
+            values = sorted(self._values)
+        if not values:
+            return {"count": 0, "p50_ms": 0, "p95_ms": 0, "max_ms": 0}
+        pick = lambda q: round(values[min(len(values) - 1, int(len(values) * q))], 2)
+        return {"count": len(values), "p50_ms": pick(0.5), "p95_ms": pick(0.95), "max_ms": round(values[-1], 2)}
+
+# ================= 服务端 =================
+class OcrServer:
+    def __init__(self, max_batch: int = MAX_BATCH, batch_window: float = BATCH_WINDOW, threads: int = OCR_THREADS):
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self.threads = max(1, threads)
+        self.model = load_model()
+        self.executor = ThreadPoolExecutor(max_workers=self.threads)
+        self.queue = None
+        self.latency = LatencyWindow()
+        self.infer_latency = LatencyWindow()
+        self.batches = 0
+        self.items = 0
+        self._tasks = set()
+
+    async def serve(self, socket_path: str):
+        self.queue = asyncio.Queue()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = await asyncio.start_unix_server(self.handle, path=socket_path, backlog=BACKLOG)
+        asyncio.get_running_loop().create_task(self.batcher())
+        async with server:
+            await server.serve_forever()
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                header = await reader.readexactly(5)
+                op, size = header[:1], struct.unpack(">I", header[1:])[0]
+                payload = await reader.readexactly(size) if size else b""
+                if op == OP_CLASSIFY:
+                    fut = asyncio.get_running_loop().create_future()
+                    await self.queue.put((payload, fut, time.perf_counter()))
+                    reply = await fut
+                elif op == OP_STATS:
+                    reply = self.stats()
+                else:
+                    reply = {"error": "unknown op"}
+                data = json.dumps(reply).encode('utf-8')
+                writer.write(struct.pack(">I", len(data)) + data)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def batcher(self):
+        """每个空闲推理线程取一批；线程都忙时请求继续排队，下一批因此更大"""
+        loop = asyncio.get_running_loop()
+        free = asyncio.Semaphore(self.threads)
+        while True:
+            await free.acquire()
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            task = loop.create_task(self.run_batch(batch))
+            self._tasks.add(task)  # 持有引用，防止被垃圾回收
+            task.add_done_callback(self._tasks.discard)
+            task.add_done_callback(lambda _: free.release())
+
+    async def run_batch(self, batch: list):
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        results = await loop.run_in_executor(self.executor, classify_batch, self.model, [b[0] for b in batch])
+        done = time.perf_counter()
+        self.infer_latency.add((done - start) * 1000 / len(batch))
+        self.batches += 1
+        self.items += len(batch)
+        for (_, fut, enqueued), result in zip(batch, results):
+            self.latency.add((done - enqueued) * 1000)
+            if not fut.done():
+                fut.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "mode": "service",
+            "threads": self.threads,
+            "queue_depth": self.queue.qsize() if self.queue else 0,
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0,
+            "latency": self.latency.summary(),
+            "inference": self.infer_latency.summary(),
+        }
+
+# ================= 客户端 =================
+class OcrClient:
+    """识别客户端：配置了 socket 时通过长连接调用 OCR 服务，否则在本进程懒加载模型"""
+
+    def __init__(self, socket_path: str = None, connections: int = CLIENT_CONNECTIONS):
+        self.socket_path = socket_path
+        self.connections = connections
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._slots = None  # asyncio.Semaphore，在事件循环内首次调用时创建
+        self._idle = []     # 空闲的 (reader, writer)
+        self.latency = LatencyWindow()
+        self.in_flight = 0
+        self.unavailable = 0  # 服务不可用 / 超时导致识别失败的次数
+        self._unavailable_logged = 0.0
+
+    @classmethod
+    def from_env(cls):
+        return cls(os.environ.get("OCR_SERVICE_SOCKET") or None)
+
+    def _local_model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    self._model = load_model()
+        return self._model
+
+    def warm_up(self):
+        """预加载模型 (阻塞，供预热线程调用)；服务模式下模型在 OCR 服务进程中，无需加载"""
+        if not self.socket_path:
+            self._local_model()
+
+    async def _call(self, op: bytes, payload: bytes = b"", timeout: float = CALL_TIMEOUT) -> dict:
+        """排队等连接 + 一问一答，整体不超过 timeout"""
+        return await asyncio.wait_for(self._exchange(op, payload), timeout)
+
+    async def _exchange(self, op: bytes, payload: bytes) -> dict:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.connections)
+        async with self._slots:
+            # 复用的空闲连接可能已被服务端关闭 (服务重启)，失败时换一条新连接重试一次
+            while True:
+                reused = bool(self._idle)
+                if reused:
+                    reader, writer = self._idle.pop()
+                else:
+                    reader, writer = await asyncio.wait_for(
+                        asyncio.open_unix_connection(self.socket_path), CONNECT_TIMEOUT
+                    )
+                try:
+                    writer.write(op + struct.pack(">I", len(payload)) + payload)
+                    await writer.drain()
+                    size = struct.unpack(">I", await reader.readexactly(4))[0]
+                    reply = json.loads(await reader.readexactly(size))
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    writer.close()
+                    if reused:
+                        continue
+                    raise
+                except BaseException:
+                    # 超时被取消等：连接上可能还有未读完的响应，不再复用
+                    writer.close()
+                    raise
+                self._idle.append((reader, writer))
+                return reply
+
+    def _log_unavailable(self, e: Exception):
+        """服务挂掉后没有进程会重启它，每次识别都会失败，至少要在日志里看得到"""
+        self.unavailable += 1
+        now = time.monotonic()
+        if now - self._unavailable_logged >= UNAVAILABLE_LOG_INTERVAL:
+            self._unavailable_logged = now
+            print(f"[ocr] OCR 服务不可用 ({type(e).__name__}: {e})，本次识别失败，改为手动输入验证码 (累计 {self.unavailable} 次)")
+
+    async def classify(self, img_bytes: bytes, timeout: float = None) -> str:
+        """timeout 为调用方剩余的耗时预算，不超过 CALL_TIMEOUT；服务不可用或超时抛出 OcrUnavailable"""
+        timeout = min(CALL_TIMEOUT, timeout or CALL_TIMEOUT)
+        start = time.perf_counter()
+        self.in_flight += 1
+        try:
+            if self.socket_path:
+                try:
+                    reply = await self._call(OP_CLASSIFY, img_bytes, timeout)
+                except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                    self._log_unavailable(e)
+                    raise OcrUnavailable(str(e) or type(e).__name__) from e
+                if "error" in reply:
+                    raise RuntimeError(reply["error"])
+                return reply["text"]
+            # 未配置服务：本进程推理 (放到线程池，避免阻塞事件循环)；首次加载模型也受 timeout 限制
+            loop = asyncio.get_running_loop()
+
+            async def run():
+                model = await loop.run_in_executor(None, self._local_model)
+                return await loop.run_in_executor(None, model.classification, img_bytes)
+
+            try:
+                return await asyncio.wait_for(run(), timeout)
+            except asyncio.TimeoutError as e:
+                raise OcrUnavailable("本地识别超时") from e
+        finally:
+            self.in_flight -= 1
+            self.latency.add((time.perf_counter() - start) * 1000)
+
+    async def stats(self) -> dict:
+        """队列深度与延迟：服务模式下合并服务端统计"""
+        local = {"in_flight": self.in_flight, "unavailable": self.unavailable, "latency": self.latency.summary()}
+        if self.socket_path:
+            try:
+                return {**await self._call(OP_STATS), "client": local}
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+                pass
+        return {"mode": "local", "queue_depth": self.in_flight, "client": local}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HBUT 验证码识别服务")
+    parser.add_argument("--socket", default=os.environ.get("OCR_SERVICE_SOCKET", "/tmp/hbut-ocr.sock"))
+    parser.add_argument("--threads", type=int, default=OCR_THREADS, help="推理线程数 (默认 OCR_THREADS 或 1)")
+    args = parser.parse_args()
+    asyncio.run(OcrServer(threads=args.threads).serve(args.socket))
@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+"""上游代理 IP 池 (由 代理ip/test.py 的检测脚本演变而来)
+
+- 后台定时从代理 API (和/或静态列表) 拉取候选代理，并发检测后入池
+- 每个代理按实际流量打分：EWMA 延迟 + EWMA 成功率；403/429 或检测页内容不对视为被封
+- 被封或成功率过低的代理自动剔除，被封的一段时间内不再入池
+- 登录时为会话挑一个代理，写入 token，之后该用户的请求都走同一个出口 IP
+  (见 IP_Solutions.md "按Session绑定")
+
+同一台机器的所有 worker 共用一个代理池：池与封禁表写在共享状态文件 (PROXY_POOL_STATE_PATH)，
+到了刷新时间，抢到 claim 文件的 worker 负责检测，其他 worker 每 SYNC_INTERVAL 秒同步一次；
+某个 worker 剔除的代理也写回共享状态，所以 token 绑定的代理在各 worker 上一致。
+检测请求同样经过限速 (验证码优先级)，额度不足时本轮跳过该代理。
+
+未配置 PROXY_POOL_API / PROXY_LIST 时代理池不启用，所有请求直连。
+"""
+import asyncio
+import fcntl
+import json
+import os
+import random
+import tempfile
+import time
+from urllib.parse import urlsplit
+
+import httpx
+
+from governor import PRIORITY_CAPTCHA, UpstreamBusy
+
+BAN_STATUS = (403, 429)
+SYNC_INTERVAL = 10  # 非负责刷新的 worker 多久读一次共享状态 (秒)
+
+def default_state_path() -> str:
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, "hbut-proxy-pool.json")
+
+class ProxyStats:
+    __slots__ = ("url", "latency", "success", "samples", "added_at")
+
+    def __init__(self, url: str, latency: float):
+        self.url = url
+        self.latency = latency  # EWMA 延迟 (秒)
+        self.success = 1.0      # EWMA 成功率
+        self.samples = 0
+        self.added_at = time.monotonic()
+
+    def score(self) -> float:
+        return self.success / max(self.latency, 0.01)
+
+class ProxyPool:
+    def __init__(self, api_url: str = "", static: tuple = (), check_url: str = "",
+                 check_expect: str = "", check_timeout: float = 3, refresh_interval: float = 300,
+                 fetch_count: int = 200, concurrency: int = 10, ban_ttl: float = 3600,
+                 min_success: float = 0.5, on_evict=None, governor=None, state_path: str = None):
+        """on_evict(url): 代理被剔除时回调 (用于关闭该代理的连接池)；governor: 检测请求的限速 (RateGovernor)"""
+        self.api_url = api_url
+        self.static = tuple(static)
+        self.check_url = check_url
+        self.check_expect = check_expect
+        self.check_timeout = check_timeout
+        self.refresh_interval = refresh_interval
+        self.fetch_count = fetch_count
+        self.concurrency = concurrency
+        self.ban_ttl = ban_ttl
+        self.min_success = min_success
+        self.on_evict = on_evict
+        self.governor = governor
+        self.state_path = state_path or default_state_path()
+        self._proxies = {}  # url -> ProxyStats
+        self._banned = {}   # url -> 解封时间 (time.time())
+        self._state_mtime = None
+        self._task = None
+        self.refreshes = 0
+        self.checked = 0
+        self.skipped = 0
+        self.evicted = 0
+        self.bans = 0
+
+    @classmethod
+    def from_env(cls, check_url: str, check_expect: str = "", on_evict=None, governor=None):
+        static = [p.strip() for p in os.environ.get("PROXY_LIST", "").split(",") if p.strip()]
+        return cls(
+            api_url=os.environ.get("PROXY_POOL_API", ""), static=static,
+            check_url=os.environ.get("PROXY_CHECK_URL", check_url), check_expect=check_expect,
+            refresh_interval=float(os.environ.get("PROXY_POOL_REFRESH", 300)), on_evict=on_evict,
+            governor=governor, state_path=os.environ.get("PROXY_POOL_STATE_PATH") or None
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.api_url or self.static)
+
+    def start(self):
+        if self.enabled and (self._task is None or self._task.done()):
+            self._task = asyncio.get_running_loop().create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    # ---------- 选取与绑定 ----------
+    def pick(self) -> str:
+        """为新会话挑一个代理：在得分最高的几个里随机选，分散出口 IP；池空返回 None (直连)"""
+        if not self._proxies:
+            return None
+        best = sorted(self._proxies.values(), key=ProxyStats.score, reverse=True)[:3]
+        return random.choice(best).url
+
+    def resolve(self, url: str) -> str:
+        """token 中绑定的代理仍可用就继续用，已被剔除则换一个"""
+        if url and url not in self._proxies:
+            self._sync()  # 可能是别的 worker 刚检测入池、本 worker 还没同步到
+        if url and url in self._proxies:
+            return url
+        return self.pick() if url else None
+
+    # ---------- 打分 ----------
+    def report(self, url: str, ok: bool, latency: float = None, banned: bool = False):
+        """记录一次经由该代理的请求结果 (upstream 在每次请求后调用)"""
+        stats = self._proxies.get(url)
+        if stats is None:
+            return
+        if banned:
+            self.bans += 1
+            self._banned[url] = time.time() + self.ban_ttl
+            self._evict(url)
+            self._publish_eviction(url, self._banned[url])
+            return
+        stats.samples += 1
+        stats.success = 0.8 * stats.success + 0.2 * (1.0 if ok else 0.0)
+        if ok and latency is not None:
+            stats.latency = 0.7 * stats.latency + 0.3 * latency
+        if stats.samples >= 3 and stats.success < self.min_success:
+            self._evict(url)
+            self._publish_eviction(url)
+
+    def _evict(self, url: str):
+        if self._proxies.pop(url, None) is not None:
+            self.evicted += 1
+            if self.on_evict:
+                self.on_evict(url)
+
+    # ---------- 共享状态 ----------
+    def _read_state(self) -> dict:
+        try:
+            with open(self.state_path, encoding="utf-8") as f:
+                state = json.load(f)
+            return state if isinstance(state, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _update_state(self, change):
+        """加锁读出共享状态，change(state) 原地修改后原子写回"""
+        try:
+            with open(f"{self.state_path}.lock", "a") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                state = self._read_state()
+                state.setdefault("proxies", {})
+                state.setdefault("banned", {})
+                change(state)
+                tmp = f"{self.state_path}.{os.getpid()}.tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(state, f)
+                os.replace(tmp, self.state_path)
+        except OSError as e:
+            print(f"[proxy_pool] 写入 {self.state_path} 失败: {e}")
+
+    def _publish_eviction(self, url: str, banned_until: float = None):
+        def change(state):
+            state["proxies"].pop(url, None)
+            if banned_until:
+                state["banned"][url] = banned_until
+        self._update_state(change)
+
+    def _sync(self):
+        """共享状态有变化时，按它更新本 worker 的池：新入池的加入，别处剔除的移除 (本地打分保留)"""
+        try:
+            mtime = os.stat(self.state_path).st_mtime
+        except OSError:
+            return
+        if mtime == self._state_mtime:
+            return
+        self._state_mtime = mtime
+        state = self._read_state()
+        now = time.time()
+        self._banned = {u: t for u, t in state.get("banned", {}).items() if t > now}
+        shared = state.get("proxies", {})
+        for url in [u for u in self._proxies if u not in shared]:
+            self._evict(url)
+        for url, s in shared.items():
+            if url not in self._proxies:
+                stats = ProxyStats(url, s["latency"])
+                stats.success = s["success"]
+                self._proxies[url] = stats
+
+    def _publish(self):
+        """负责刷新的 worker 写回检测结果；刷新期间其他 worker 封禁的代理不再放回"""
+        def change(state):
+            now = time.time()
+            banned = {u: t for u, t in {**state["banned"], **self._banned}.items() if t > now}
+            state["banned"] = banned
+            state["proxies"] = {u: {"latency": s.latency, "success": s.success}
+                                for u, s in self._proxies.items() if u not in banned}
+            state["refreshed_at"] = now
+        self._update_state(change)
+        self._state_mtime = None
+        self._sync()
+
+    def _claim_path(self) -> str:
+        return f"{self.state_path}.claim"
+
+    def _claim(self) -> bool:
+        """抢本轮的刷新权 (O_EXCL 创建 claim 文件)；超过一个刷新周期的 claim 视为失效"""
+        path = self._claim_path()
+        for _ in range(2):
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return True
+            except FileExistsError:
+                try:
+                    if time.time() - os.stat(path).st_mtime < self.refresh_interval:
+                        return False
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+            except OSError:
+                return True  # 无法创建 claim 文件 (目录不可写等)：各 worker 自行刷新
+        return False
+
+    def _release(self):
+        try:
+            os.unlink(self._claim_path())
+        except OSError:
+            pass
+
+    # ---------- 刷新与检测 ----------
+    async def fetch_candidates(self) -> list:
+        """从代理 API 获取候选代理 (格式与 代理ip/test.py 一致)，并加上静态列表"""
+        candidates = list(self.static)
+        if self.api_url:
+            # 教务系统是 HTTPS，只要支持 CONNECT 的代理
+            params = {"protocol": "https", "count": self.fetch_count, "country_code": "CN"}
+            try:
+                async with httpx.AsyncClient(timeout=10) as client:
+                    data = (await client.get(self.api_url, params=params)).json()
+                if data.get("code") == 200:
+                    candidates += [p if "://" in p else f"http://{p}" for p in data["data"]["proxies"]]
+            except Exception as e:
+                print(f"[proxy_pool] 获取代理失败: {e}")
+        return candidates
+
+    async def check_proxy(self, url: str):
+        """检测单个代理，返回 (ok, latency, banned)；限速额度不足时抛出 UpstreamBusy"""
+        if self.governor:
+            await self.governor.acquire(urlsplit(self.check_url).hostname, PRIORITY_CAPTCHA)
+        start = time.monotonic()
+        try:
+            async with httpx.AsyncClient(proxy=url, timeout=self.check_timeout) as client:
+                resp = await client.get(self.check_url)
+        except Exception:
+            return False, None, False
+        latency = time.monotonic() - start
+        if resp.status_code in BAN_STATUS:
+            return False, latency, True
+        if resp.status_code != 200:
+            return False, latency, False
+        # 状态码正常但内容不是预期页面：多半是防火墙的拦截页
+        if self.check_expect and self.check_expect not in resp.text:
+            return False, latency, True
+        return True, latency, False
+
+    async def refresh(self):
+        """检测新候选与池中已有代理，合格的入池 (已有的更新延迟)"""
+        now = time.time()
+        self._banned = {u: t for u, t in self._banned.items() if t > now}
+        candidates = {u for u in await self.fetch_candidates() if u not in self._banned}
+        candidates.update(self._proxies)
+        sem = asyncio.Semaphore(self.concurrency)
+
+        async def check(url):
+            async with sem:
+                try:
+                    ok, latency, banned = await self.check_proxy(url)
+                except UpstreamBusy:
+                    self.skipped += 1  # 额度留给真实请求，池中已有的保持原样，新候选下轮再测
+                    return
+            self.checked += 1
+            if banned or not ok:
+                if url in self._proxies:
+                    self.report(url, ok=False, banned=banned)
+                elif banned:
+                    self._banned[url] = time.time() + self.ban_ttl
+            elif url in self._proxies:
+                self.report(url, ok=True, latency=latency)
+            else:
+                self._proxies[url] = ProxyStats(url, latency)
+
+        await asyncio.gather(*(check(u) for u in candidates))
+
+    async def _refresh_loop(self):
+        while True:
+            self._sync()
+            due = time.time() - self._read_state().get("refreshed_at", 0) >= self.refresh_interval
+            if due and self._claim():
+                # 抢到 claim 之前，另一个 worker 可能刚好刷新完
+                self._state_mtime = None
+                self._sync()
+                try:
+                    if time.time() - self._read_state().get("refreshed_at", 0) >= self.refresh_interval:
+                        await self.refresh()
+                        self.refreshes += 1
+                        self._publish()
+                    self._release()
+                except Exception as e:
+                    # claim 保留到超时，避免每个 worker 轮流重试失败的刷新
+                    print(f"[proxy_pool] 刷新失败: {e}")
+            await asyncio.sleep(SYNC_INTERVAL)
+
+    def stats(self) -> dict:
+        top = sorted(self._proxies.values(), key=ProxyStats.score, reverse=True)[:5]
+        # 只展示 host:port，不暴露代理账号密码
+        return {
+            "enabled": self.enabled, "size": len(self._proxies), "banned": len(self._banned),
+            "refreshes": self.refreshes, "checked": self.checked, "skipped": self.skipped,
+            "evicted": self.evicted, "bans": self.bans,
+            "top": [{"url": s.url.rsplit("@", 1)[-1], "latency_ms": round(s.latency * 1000), "success": round(s.success, 2)} for s in top]
+        }
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""成绩排名页 (getXscjpm) 增量解析
+
+边下载边解析：不构建 DOM 树，只从文本中找 "平均学分绩点：x"、"算术平均分：x"，
+从表格行中找第一列为 "平均学分绩点" 的排名行；全部找到后即可停止读取并关闭连接。
+超过解析时间预算时也会提前结束，未找到的字段保持 "无"。
+"""
+import html as html_lib
+import re
+import time
+
+from html_clean import _TAG_RE, clean_text
+
+_GPA_RE = re.compile(r"平均学分绩点\s*[：:]\s*([0-9.]+)")
+_AVG_RE = re.compile(r"算术平均分\s*[：:]\s*([0-9.]+)")
+_ROW_START_RE = re.compile(r"<tr\b", re.IGNORECASE)
+_ROW_END_RE = re.compile(r"</tr\s*>|<tr\b|</table\s*>", re.IGNORECASE)
+_TD_RE = re.compile(r"<td\b[^>]*>(.*?)(?=</td\s*>|<td\b|$)", re.IGNORECASE | re.DOTALL)
+
+# 文本正则可能跨越两次 feed 的边界，保留一段尾部重新匹配
+_TEXT_OVERLAP = 64
+RANK_LABEL = "平均学分绩点"
+
+class RankPageParser:
+    def __init__(self, budget_ms: float = 50):
+        self.budget = budget_ms / 1000
+        self.elapsed = 0.0
+        self.over_budget = False
+        self.gpa = None
+        self.avg_score = None
+        self.ranks = None  # (major_rank, class_rank)
+        self._raw = ""      # 尚未处理完的 HTML
+        self._text = ""     # 去标签后的文本尾部 (只在摘要未找全时保留)
+        self._text_pos = 0  # _raw 中已转成文本的位置
+        self._row_pos = 0   # _raw 中下一个待找 <tr 的位置
+
+    @property
+    def done(self) -> bool:
+        return self.over_budget or (self.gpa is not None and self.avg_score is not None and self.ranks is not None)
+
+    def feed(self, chunk: str) -> bool:
+        """输入一段 HTML，返回是否可以停止读取"""
+        if self.done: return True
+        start = time.perf_counter()
+        self._raw += chunk
+        self._consume(final=False)
+        self.elapsed += time.perf_counter() - start
+        if self.elapsed > self.budget and not self.done:
+            self.over_budget = True
+        return self.done
+
+    def close(self):
+        """输入结束，处理剩余内容"""
+        if not self.done:
+            self._consume(final=True)
+
+    def _consume(self, final: bool):
+        # 只处理到最后一个完整标签为止，避免把半个标签当成文本
+        cut = len(self._raw) if final else self._raw.rfind(">") + 1
+
+        # 1. 摘要 (结束时即使没有新内容，也要确认紧贴文本末尾的数字)
+        if (self.gpa is None or self.avg_score is None) and (cut > self._text_pos or final):
+            text = self._text + strip_tags(self._raw[self._text_pos:cut])
+            # 数字紧贴文本末尾时可能还没收全，等后续内容或结束时再确认
+            if self.gpa is None:
+                m = _GPA_RE.search(text)
+                if m and (final or m.end() < len(text)): self.gpa = m.group(1)
+            if self.avg_score is None:
+                m = _AVG_RE.search(text)
+                if m and (final or m.end() < len(text)): self.avg_score = m.group(1)
+            self._text = text[-_TEXT_OVERLAP:]
+        self._text_pos = max(self._text_pos, cut)
+
+        # 2. 排名行：行在 </tr>、下一个 <tr 或 </table> 处结束
+        pos = self._row_pos
+        while self.ranks is None:
+            m = _ROW_START_RE.search(self._raw, pos, cut)
+            if not m:
+                pos = cut
+                break
+            end = _ROW_END_RE.search(self._raw, m.end(), cut)
+            if not end:
+                if final: self._check_row(self._raw[m.end():cut])
+                pos = m.start()
+                break
+            self._check_row(self._raw[m.end():end.start()])
+            pos = end.start()
+        if self.ranks is not None: pos = cut
+        self._row_pos = max(self._row_pos, pos)
+
+        # 丢掉两边都已处理完的部分
+        keep = min(self._text_pos, self._row_pos)
+        if keep:
+            self._raw = self._raw[keep:]
+            self._text_pos -= keep
+            self._row_pos -= keep
+
+    def _check_row(self, row_html: str):
+        if RANK_LABEL not in row_html: return
+        cells = [clean_text(c) for c in _TD_RE.findall(row_html)]
+        if len(cells) >= 4 and cells[0] == RANK_LABEL:
+            self.ranks = (cells[2], cells[3])
+
+    def result(self) -> dict:
+        res = {"gpa": "无", "class_rank": "无", "major_rank": "无", "avg_score": "无", "fail_count": "0"}
+        if self.gpa is not None: res["gpa"] = self.gpa
+        if self.avg_score is not None: res["avg_score"] = self.avg_score
+        if self.ranks is not None: res["major_rank"], res["class_rank"] = self.ranks
+        return res
+
+def strip_tags(fragment: str) -> str:
+    """去掉标签并反转义实体 (与 get_text() 一致，不做 strip)"""
+    text = _TAG_RE.sub("", fragment)
+    return html_lib.unescape(text) if "&" in text else text
+
+def parse_rank_page(html: str, budget_ms: float = 50) -> dict:
+    """一次性解析完整页面"""
+    parser = RankPageParser(budget_ms)
+    parser.feed(html)
+    parser.close()
+    return parser.result()
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""相同上游请求合并 (single-flight)
+
+同一学生连点刷新、或前台刷新与后台静默刷新重叠时，相同 key 的并发请求
+只会真正访问一次上游，其余请求等待并共享同一个解析结果 (或同一个异常)。
+协程与线程池两种调用方式各有一套在途表，互不干扰。
+"""
+import asyncio
+import threading
+from concurrent.futures import Future
+
+class SingleFlight:
+    def __init__(self):
+        self._async_calls = {}  # key -> asyncio.Future
+        self._sync_calls = {}   # key -> concurrent.futures.Future
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key, func):
+        """func 为无参协程函数；key 相同的并发调用共享一次执行结果"""
+        fut = self._async_calls.get(key)
+        if fut is None:
+            self.leaders += 1
+            # 独立任务执行：发起者被取消 (客户端断开) 时，其他等待者不受影响
+            fut = asyncio.ensure_future(func())
+            self._async_calls[key] = fut
+            fut.add_done_callback(lambda f: self._async_done(key, f))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(fut)
+
+    def _async_done(self, key, fut):
+        self._async_calls.pop(key, None)
+        # 取走异常，避免所有等待者都已取消时出现 "exception was never retrieved"
+        if not fut.cancelled():
+            fut.exception()
+
+    def do_sync(self, key, func):
+        """线程池版本：func 为普通函数"""
+        with self._lock:
+            fut = self._sync_calls.get(key)
+            leader = fut is None
+            if leader:
+                fut = self._sync_calls[key] = Future()
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+        if leader:
+            try:
+                fut.set_result(func())
+            except BaseException as e:
+                fut.set_exception(e)
+            finally:
+                with self._lock:
+                    self._sync_calls.pop(key, None)
+        return fut.result()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._async_calls) + len(self._sync_calls),
+            "leaders": self.leaders, "coalesced": self.coalesced
+        }
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""请求分阶段耗时 (Server-Timing 响应头 + 可选的 JSON-lines 追踪文件)
+
+    with span("cas_page"):
+        ...
+
+被采样的请求 (TRACE_SAMPLE_RATE，或请求头 X-Trace: 1) 会记录每个阶段的起止时间，
+响应时写入 Server-Timing 头，配置了 TRACE_FILE 时再追加一行 JSON。
+未采样的请求里 span() 只读一次 contextvar 并返回空操作对象，开销可以忽略。
+asyncio.gather 的子任务继承同一个 Trace，并发阶段会各自记录 (时间上重叠)。
+"""
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+import uuid
+
+_current = contextvars.ContextVar("trace", default=None)
+
+class Trace:
+    __slots__ = ("id", "start", "spans")
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex[:16]
+        self.start = time.perf_counter()
+        self.spans = []  # (name, start_offset, duration)
+
+    def server_timing(self) -> str:
+        parts = [f"{name};dur={dur * 1000:.1f}" for name, _, dur in self.spans]
+        parts.append(f"total;dur={(time.perf_counter() - self.start) * 1000:.1f}")
+        return ", ".join(parts)
+
+    def to_dict(self, route: str, status: int) -> dict:
+        return {
+            "ts": round(time.time(), 3), "trace_id": self.id, "route": route, "status": status,
+            "total_ms": round((time.perf_counter() - self.start) * 1000, 1),
+            "spans": [{"name": n, "start_ms": round(s * 1000, 1), "dur_ms": round(d * 1000, 1)} for n, s, d in self.spans],
+        }
+
+class _Span:
+    __slots__ = ("trace", "name", "start")
+
+    def __init__(self, trace: Trace, name: str):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        self.trace.spans.append((self.name, self.start - self.trace.start, end - self.start))
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+_NOOP = _NoopSpan()
+
+def span(name: str):
+    trace = _current.get()
+    return _NOOP if trace is None else _Span(trace, name)
+
+class Tracer:
+    def __init__(self, sample_rate: float = 0.0, path: str = None):
+        self.sample_rate = sample_rate
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(float(os.environ.get("TRACE_SAMPLE_RATE", 0)), os.environ.get("TRACE_FILE") or None)
+
+    def begin(self, force: bool = False):
+        """决定是否采样；采样时创建 Trace 并设为当前上下文，返回 (trace, reset_token)"""
+        if not force and (self.sample_rate <= 0 or random.random() >= self.sample_rate):
+            return None, None
+        trace = Trace()
+        return trace, _current.set(trace)
+
+    def end(self, trace: Trace, reset_token, route: str, status: int):
+        _current.reset(reset_token)
+        if not self.path:
+            return
+        line = json.dumps(trace.to_dict(route, status), ensure_ascii=False) + "\n"
+        with self._lock:
+            if self._file is None:
+                # 追加模式：多个 worker 写同一个文件时，单行写入不会交错
+                self._file = open(self.path, "a", encoding="utf-8", buffering=1)
+            self._file.write(line)
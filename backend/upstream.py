@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""上游 (统一认证 / 教务系统) 异步 HTTP 客户端
+
+每个上游主机共享一个 keep-alive、支持 HTTP/2 的连接池，避免每次请求重新握手；
+Cookie 则按请求隔离：UpstreamSession 持有自己的 Cookie Jar (由 token 中的 cookies 构建)，
+共享客户端本身不保存任何 Cookie，不会在不同用户之间串号。
+会话可绑定一个代理 (见 proxy_pool.py)，此时按 (主机, 代理) 共享连接池，并把每次请求的结果反馈给代理池打分。
+会话也可带一个 Deadline (见 deadline.py)：每次请求 (含重定向的每一跳) 的超时不超过剩余预算。
+注入 AdaptiveTimeouts (见 adaptive.py) 后，超时按各 URL 的实际耗时调整，可对冲的 GET 慢于 p95 时再发一份。
+注入 CircuitBreakers (见 breaker.py) 后，熔断中的主机直接抛出 CircuitOpen，不再等待超时。
+"""
+import asyncio
+import http.cookiejar
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+from urllib.parse import urljoin, urlsplit
+
+import httpx
+
+from governor import PRIORITY_DATA, PRIORITY_CAPTCHA, UpstreamBusy
+from deadline import DeadlineExceeded, MIN_STEP
+
+# 连接池参数 (单个 worker 内所有请求共享)
+POOL_LIMITS = httpx.Limits(max_connections=200, max_keepalive_connections=50, keepalive_expiry=30)
+DEFAULT_TIMEOUT = httpx.Timeout(10.0)
+MAX_REDIRECTS = 10
+
+class _RejectAllCookies(http.cookiejar.DefaultCookiePolicy):
+    """共享客户端的 Cookie 策略：一律不保存"""
+    def set_ok(self, cookie, request):
+        return False
+
+_clients: Dict[tuple, httpx.AsyncClient] = {}
+_closing = set()
+governor = None    # RateGovernor，由应用启动时通过 set_governor 注入；为 None 时不限速
+proxy_pool = None  # ProxyPool，通过 set_proxy_pool 注入；用于反馈代理的延迟/成功率/封禁
+observer = None    # observer(url) 在请求发出时调用，返回 done(status) 在收到响应头 (或失败，status=None) 时调用
+adaptive = None    # AdaptiveTimeouts，通过 set_adaptive 注入；为 None 时使用调用方的固定超时、不对冲
+breakers = None    # CircuitBreakers，通过 set_breakers 注入；为 None 时不熔断
+
+def set_governor(g):
+    global governor
+    governor = g
+
+def set_proxy_pool(pool):
+    global proxy_pool
+    proxy_pool = pool
+
+def set_observer(func):
+    global observer
+    observer = func
+
+def set_adaptive(a):
+    global adaptive
+    adaptive = a
+
+def set_breakers(b):
+    global breakers
+    breakers = b
+
+def _domain_matches(host: str, domain: str) -> bool:
+    domain = domain.lstrip(".")
+    return not domain or host == domain or host.endswith("." + domain)
+
+def get_client(host: str, proxy: Optional[str] = None) -> httpx.AsyncClient:
+    """按 (主机, 代理) 获取 (或创建) 共享的长连接客户端"""
+    client = _clients.get((host, proxy))
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            http2=True,
+            limits=POOL_LIMITS,
+            timeout=DEFAULT_TIMEOUT,
+            cookies=http.cookiejar.CookieJar(policy=_RejectAllCookies()),
+            follow_redirects=False,
+            proxy=proxy,
+        )
+        _clients[(host, proxy)] = client
+    return client
+
+def discard_proxy(proxy: str):
+    """代理被剔除后关闭经由它的连接池 (在事件循环中调用)"""
+    for key in [k for k in _clients if k[1] == proxy]:
+        task = asyncio.get_running_loop().create_task(_clients.pop(key).aclose())
+        _closing.add(task)
+        task.add_done_callback(_closing.discard)
+
+async def close_clients():
+    """关闭所有连接池 (应用退出时调用)"""
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        await client.aclose()
+
+class UpstreamSession:
+    """单个请求 (单个用户) 的会话：独立的 headers 与 Cookie Jar，连接池共享"""
+
+    def __init__(self, headers: Optional[dict] = None, cookies: Optional[dict] = None,
+                 priority: int = PRIORITY_DATA, proxy: Optional[str] = None, deadline=None,
+                 cookie_domain: str = ""):
+        self.headers = dict(headers or {})
+        self.priority = priority  # 限速优先级 (见 governor.py)
+        self.proxy = proxy        # 绑定的代理 URL，None 为直连
+        self.deadline = deadline  # 请求的耗时预算 (Deadline)，None 为不限
+        self.cookies = httpx.Cookies()
+        if cookies:
+            self.update_cookies(cookies, cookie_domain)
+
+    def update_cookies(self, cookies: dict, domain: str = ""):
+        """domain 为空时 Cookie 不限定域名，发往所有主机 (get_dict 也对任何 host 都返回它)"""
+        for name, value in cookies.items():
+            self.cookies.set(name, value, domain=domain)
+
+    def get_dict(self, host: Optional[str] = None) -> dict:
+        """与 requests 的 cookies.get_dict() 一致：同名 Cookie 取最后一个
+
+        指定 host 时只返回会发送给该主机的 Cookie (未限定域名的也保留)
+        """
+        return {
+            c.name: c.value for c in self.cookies.jar
+            if host is None or _domain_matches(host, c.domain)
+        }
+
+    def _timeout(self, key: str, timeout):
+        """本次请求的超时：按该 URL 的实际耗时调整，再按剩余预算收紧；预算已用完时抛出 DeadlineExceeded"""
+        if self.deadline is None and adaptive is None:
+            return timeout
+        cap = DEFAULT_TIMEOUT.read if timeout is httpx.USE_CLIENT_DEFAULT else timeout
+        if adaptive:
+            cap = adaptive.timeout(key, cap)
+        return cap if self.deadline is None else self.deadline.timeout(cap)
+
+    def _out_of_budget(self) -> bool:
+        return self.deadline is not None and self.deadline.remaining() < MIN_STEP
+
+    async def _send(self, client: httpx.AsyncClient, request: httpx.Request, stream: bool = False) -> httpx.Response:
+        """发送请求并记录耗时；超时发生在预算用完时，转为 DeadlineExceeded"""
+        start = time.monotonic()
+        try:
+            resp = await self._send_reported(client, request, stream)
+        except httpx.TimeoutException as e:
+            # 超时的耗时也计入样本，上游变慢时超时随之放宽
+            if adaptive:
+                adaptive.observe(str(request.url.copy_with(query=None)), time.monotonic() - start)
+            if self._out_of_budget():
+                raise DeadlineExceeded(f"预算 {self.deadline.budget:g}s 已用完") from e
+            raise
+        if adaptive:
+            adaptive.observe(str(request.url.copy_with(query=None)), time.monotonic() - start)
+        return resp
+
+    async def _send_hedged(self, client: httpx.AsyncClient, build, host: str, delay: float, stream: bool) -> httpx.Response:
+        """delay 秒内没有返回时再发一份 (对冲额度允许时)，返回先成功的响应，取消/关闭另一个"""
+        tasks = [asyncio.ensure_future(self._send(client, build(), stream))]
+        winner = None
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done and adaptive.take_hedge():
+                try:
+                    # 对冲是可有可无的额外请求，按最低优先级取令牌，额度紧张时放弃
+                    if governor:
+                        await governor.acquire(host, PRIORITY_CAPTCHA)
+                    tasks.append(asyncio.ensure_future(self._send(client, build(), stream)))
+                except (UpstreamBusy, DeadlineExceeded):
+                    pass
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((t for t in tasks if t in done and t.exception() is None), None)
+                if winner is not None:
+                    if winner is not tasks[0]:
+                        adaptive.hedge_won()
+                    return winner.result()
+            raise tasks[0].exception()
+        finally:
+            for t in tasks:
+                if t is winner:
+                    continue
+                if not t.done():
+                    t.cancel()
+                elif not t.cancelled() and t.exception() is None:
+                    await t.result().aclose()
+
+    async def _fetch(self, method: str, url: str, params, data, timeout, stream: bool = False) -> httpx.Response:
+        """取令牌并发送一次请求 (不跟随重定向)"""
+        host = urlsplit(url).netloc
+        if breakers:
+            breakers.check(host)
+        if governor:
+            await governor.acquire(host, self.priority)
+        client = get_client(host, self.proxy)
+        key = str(httpx.URL(url).copy_with(query=None))
+
+        def build():
+            return client.build_request(
+                method, url, params=params, data=data,
+                headers=self.headers, cookies=self.cookies, timeout=self._timeout(key, timeout)
+            )
+
+        delay = adaptive.hedge_delay(key) if adaptive and method == "GET" else None
+        if delay is None:
+            return await self._send(client, build(), stream)
+        return await self._send_hedged(client, build, host, delay, stream)
+
+    async def _send_reported(self, client: httpx.AsyncClient, request: httpx.Request, stream: bool) -> httpx.Response:
+        """发送请求；经由代理时把结果反馈给代理池 (403/429 视为代理被封)，并把结果计入熔断器 (5xx 算失败)"""
+        report = self.proxy and proxy_pool
+        if not (report or observer or breakers):
+            return await client.send(request, stream=stream)
+        done = observer(str(request.url.copy_with(query=None))) if observer else None
+        start = time.monotonic()
+        try:
+            resp = await client.send(request, stream=stream)
+        except BaseException as e:
+            if done: done("cancelled" if isinstance(e, asyncio.CancelledError) else None)
+            # 因本请求的预算用完而超时不算代理或上游的错
+            if isinstance(e, httpx.TransportError) and not self._out_of_budget():
+                if report:
+                    proxy_pool.report(self.proxy, ok=False)
+                if breakers:
+                    breakers.record(urlsplit(str(request.url)).netloc, ok=False)
+            raise
+        if done: done(resp.status_code)
+        if breakers:
+            breakers.record(urlsplit(str(request.url)).netloc, ok=resp.status_code < 500)
+        if report:
+            banned = resp.status_code in (403, 429)
+            proxy_pool.report(self.proxy, ok=not banned, latency=time.monotonic() - start, banned=banned)
+        return resp
+
+    async def request(self, method: str, url: str, params=None, data=None,
+                      timeout=httpx.USE_CLIENT_DEFAULT, allow_redirects: bool = False) -> httpx.Response:
+        for _ in range(MAX_REDIRECTS + 1):
+            resp = await self._fetch(method, url, params, data, timeout)
+            self.cookies.extract_cookies(resp)
+            if not (allow_redirects and resp.is_redirect):
+                return resp
+            # 手动跟随重定向，保证跨主机时 Cookie 也由本会话管理
+            url = urljoin(str(resp.url), resp.headers["Location"])
+            if resp.status_code not in (307, 308):
+                method, data = "GET", None
+            params = None
+        raise httpx.TooManyRedirects("Exceeded maximum allowed redirects.", request=resp.request)
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, params=None, data=None, timeout=httpx.USE_CLIENT_DEFAULT):
+        """流式读取响应体 (不跟随重定向)；提前退出时关闭响应，不再继续下载"""
+        resp = await self._fetch(method, url, params, data, timeout, stream=True)
+        self.cookies.extract_cookies(resp)
+        try:
+            yield resp
+        finally:
+            await resp.aclose()
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
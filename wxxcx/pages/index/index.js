@@ -47,21 +47,51 @@ Page({
       wx.showNavigationBarLoading();
     }
 
+    const cachedGrades = wx.getStorageSync('cached_grades');
+
     try {
       const res = await new Promise((resolve, reject) => {
         wx.request({
           url: `${config.BASE_URL}/api/grades`,
           method: 'POST',
-          data: { token: wx.getStorageSync('user_token') },
+          data: {
+            token: wx.getStorageSync('user_token'),
+            // Only ask for a delta if we still hold the cached rows it applies to
+            version: cachedGrades ? wx.getStorageSync('cached_grades_version') || null : null
+          },
           success: resolve,
           fail: reject
         });
       });
 
       if (res.statusCode === 200 && res.data.code === 200) {
-        const rawGrades = res.data.data;
+        const body = res.data;
+        if (body.unchanged) {
+          if (isSilent) console.log("Background refresh: grades unchanged");
+          return;
+        }
+
+        let rawGrades;
+        if (body.delta) {
+          // Apply the delta: replace changed rows, append new ones, drop removed ones
+          const upserts = {};
+          body.upserts.forEach(g => { upserts[g.id] = g; });
+          const removed = new Set(body.removed);
+          rawGrades = cachedGrades
+            .filter(g => !removed.has(g.id))
+            .map(g => {
+              const updated = upserts[g.id];
+              delete upserts[g.id];
+              return updated || g;
+            })
+            .concat(Object.values(upserts));
+        } else {
+          rawGrades = body.data;
+        }
+
         // Success! Update Cache
         wx.setStorageSync('cached_grades', rawGrades);
+        wx.setStorageSync('cached_grades_version', body.version || '');
         this.processGrades(rawGrades);
 
         if (isSilent) console.log("Background refresh success");
@@ -148,6 +178,8 @@ Page({
       });
 
       if (res.statusCode === 200 && res.data.code === 200) {
+        // Backend may hand back a refreshed token carrying looked-up student info
+        if (res.data.user_token) wx.setStorageSync('user_token', res.data.user_token);
         this.setData({
           rankData: res.data.data,
           showRankCard: true
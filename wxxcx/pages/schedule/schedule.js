@@ -121,6 +121,8 @@ Page({
             });
 
             if (res.statusCode === 200 && res.data.code === 200) {
+                // First timetable call after login hands back a token carrying xhid
+                if (res.data.user_token) wx.setStorageSync('user_token', res.data.user_token);
                 const rawList = res.data.data;
                 const serverWeek = res.data.current_week || 1;
                 // Prioritize backend start_date
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""本地替身代理，用于在没有真实代理的情况下测试 backend/proxy_pool.py
+
+用法:
+    python stub_proxy.py 18081 ok              # 正常转发 (支持 HTTPS 的 CONNECT 隧道)
+    python stub_proxy.py 18082 slow 1.5        # 每个请求延迟 1.5 秒后再转发
+    python stub_proxy.py 18083 ban             # 一律返回 403，模拟出口 IP 被学校封禁
+    python stub_proxy.py 18084 block           # 返回 200 的拦截页，模拟防火墙页面
+
+然后启动后端时配置:
+    PROXY_LIST=http://127.0.0.1:18081,http://127.0.0.1:18082,http://127.0.0.1:18083,http://127.0.0.1:18084
+"""
+import asyncio
+import sys
+from urllib.parse import urlsplit
+
+BLOCK_PAGE = "<html><body><h1>访问被拒绝</h1><p>您的访问频率过高</p></body></html>".encode("utf-8")
+
+async def pipe(reader, writer):
+    try:
+        while data := await reader.read(65536):
+            writer.write(data)
+            await writer.drain()
+    except (ConnectionError, asyncio.CancelledError):
+        pass
+    finally:
+        writer.close()
+
+def reply(writer, status: str, body: bytes = b""):
+    writer.write(
+        f"HTTP/1.1 {status}\r\nContent-Type: text/html; charset=utf-8\r\n"
+        f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+    )
+
+async def handle(reader, writer, mode: str, delay: float):
+    head = await reader.readuntil(b"\r\n\r\n")
+    method, target, version = head.split(b"\r\n", 1)[0].decode().split(" ")
+    if mode == "slow":
+        await asyncio.sleep(delay)
+    if mode == "ban":
+        reply(writer, "403 Forbidden", b"Forbidden")
+        await writer.drain()
+        writer.close()
+        return
+    if mode == "block" and method != "CONNECT":
+        reply(writer, "200 OK", BLOCK_PAGE)
+        await writer.drain()
+        writer.close()
+        return
+
+    if method == "CONNECT":
+        host, port = target.rsplit(":", 1)
+        up_reader, up_writer = await asyncio.open_connection(host, int(port))
+        writer.write(b"HTTP/1.1 200 Connection established\r\n\r\n")
+    else:
+        # 绝对 URI 改写为 origin-form 再转发
+        url = urlsplit(target)
+        up_reader, up_writer = await asyncio.open_connection(url.hostname, url.port or 80)
+        path = (url.path or "/") + (f"?{url.query}" if url.query else "")
+        up_writer.write(f"{method} {path} {version}\r\n".encode() + head.split(b"\r\n", 1)[1])
+    await asyncio.gather(pipe(reader, up_writer), pipe(up_reader, writer))
+
+async def main(port: int, mode: str, delay: float):
+    server = await asyncio.start_server(lambda r, w: handle(r, w, mode, delay), "127.0.0.1", port)
+    print(f"替身代理 http://127.0.0.1:{port} 模式={mode}")
+    async with server:
+        await server.serve_forever()
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 18081
+    mode = sys.argv[2] if len(sys.argv) > 2 else "ok"
+    delay = float(sys.argv[3]) if len(sys.argv) > 3 else 1.0
+    asyncio.run(main(port, mode, delay))